@@ -1,76 +1,163 @@
 
+import copy
 import random
+import numpy as np
 from learners.learner import Learner
-from mcts import MonteCarloTreeSearch
+from mcts import MCTS_Parameters
+from search import new_mcts
 from simworlds.simworld import SimWorld
+from state_cache import MISSING, StateCache
 
 class Actor:
 
-    def __init__(self, sim_world: SimWorld, learner: Learner, use_mcts=False):
+    def __init__(self, sim_world: SimWorld, learner: Learner, use_mcts=False, mcts_params: MCTS_Parameters = None, cache_size=0, tactical_cache: StateCache = None):
         self.sim_world = sim_world
         self.learner = learner
+        self.learner_version = 0
+        # Learner dists are cached per actor, tactical actions only depend on the state and can be shared between actors
+        self.dist_cache = StateCache(cache_size) if cache_size else None
+        self.tactical_cache = tactical_cache if tactical_cache is not None else StateCache(cache_size) if cache_size else None
         self.use_mcts = use_mcts
         if self.use_mcts:
-            self.mcts = MonteCarloTreeSearch(self.sim_world)
+            self.mcts = new_mcts(self.sim_world, mcts_params)
 
-    def get_action(self, state, epsilon, mcts_episodes=0, check_reward=True):
+    def close(self):
+        # Stops the search's worker processes, if it has any
+        if self.use_mcts:
+            self.mcts.close()
+
+    def for_sim_world(self, sim_world):
+        # Shallow copy sharing the learner and search, playing on its own sim world
+        actor = copy.copy(self)
+        actor.sim_world = sim_world
+        return actor
+
+    def get_action(self, state, epsilon, mcts_episodes=0, check_reward=True, time_limit=0, quad_forks=False, prune_actions=True):
         if check_reward:
-            action = self.check_winning(state)
-            # print("Winning action", action)
-            if action:
-                return action
-            action = self.check_losing(state)
-            # print("Losing Action", action)
-            if action:
-                return action
-            action = self.check_winning_fork(state)
-            if action:
-                # print("Winning fork", action)
-                return action
-            action = self.check_losing_fork(state)
+            action = self.get_tactical_action(state, quad_forks)
             if action:
-                # print("Losing fork", action)
                 return action
-            """
-            action = self.check_winning_quad_fork(state)
-            if action:
-                print("Winning Quad fork", action)
-                return action
-            action = self.check_loosing_quad_fork(state)
-            if action:
-                print("Losing Quad fork", action)
-                return action
-            """
 
         # Get dist from learner or dist from mcts run with itself as actor
-        if mcts_episodes and self.use_mcts:
+        if (mcts_episodes or time_limit) and self.use_mcts:
             player = self.sim_world.get_current_player()
             self.mcts.manual_set_root(state)
-            for _ in range(mcts_episodes):
-                self.mcts.run_search_game(self, epsilon)
+            self.mcts.run_search(self, epsilon, mcts_episodes, time_limit)
             new_root, dist = self.mcts.move_next_root()
             self.sim_world.set_current_state(state, player)
         else:
-            dist = self.learner.get_dist(state)
+            dist = self.get_dist(state)
+        return self.choose_action(dist, epsilon, prune_actions)
 
-        # Set all actions that are illegal to 0
-        legal_actions = self.sim_world.get_legal_actions()
-        action_space = self.sim_world.get_action_space()
-        for i in range(len(action_space)):
-            action = action_space[i]
-            if action not in legal_actions:
-                dist[i] = 0
-
-        # Find best action based on ANET distribution output
-        best_action = self.sim_world.get_action_space()[dist.index(max(dist))]
-        # print(state, dist, best_action)
-
-        # Use best action or random action based on epsilon value
-        action = best_action
-        if random.random() < epsilon or action not in legal_actions:
-            action = legal_actions[random.randint(0, len(legal_actions) - 1)]
+    def get_dist(self, state):
+        if self.dist_cache is None:
+            return self.learner.get_dist(state)
+        self.dist_cache.validate(self.learner_version)
+        dist = self.dist_cache.get(state)
+        if dist is MISSING:
+            dist = tuple(self.learner.get_dist(state))
+            self.dist_cache.put(state, dist)
+        return dist
+
+    def get_dists(self, states):
+        # Only the states missing from the cache go to the learner, in one call
+        if self.dist_cache is None:
+            return self.learner.get_dists(states)
+        self.dist_cache.validate(self.learner_version)
+        dists = [self.dist_cache.get(state) for state in states]
+        missing = [i for i, dist in enumerate(dists) if dist is MISSING]
+        if missing:
+            for i, dist in zip(missing, self.learner.get_dists([states[i] for i in missing])):
+                dists[i] = tuple(dist)
+                self.dist_cache.put(states[i], dists[i])
+        return dists
+
+    def get_cache_stats(self):
+        stats = {}
+        if self.dist_cache is not None:
+            stats["dists"] = self.dist_cache.stats()
+        if self.tactical_cache is not None:
+            stats["tactics"] = self.tactical_cache.stats()
+        return stats
+
+    def get_batch_actions(self, actors, epsilon, check_reward=True):
+        # Actions for several actors playing on their own sim worlds, with one learner call for all that need a dist.
+        # Only used for rollouts, which choose among all legal actions
+        actions = [None] * len(actors)
+        if check_reward:
+            for i, actor in enumerate(actors):
+                actions[i] = actor.get_tactical_action(actor.sim_world.get_current_encoded_state())
+        pending = [i for i in range(len(actors)) if not actions[i]]
+        if pending:
+            dists = self.get_dists([actors[i].sim_world.get_current_encoded_state() for i in pending])
+            for i, dist in zip(pending, dists):
+                actions[i] = actors[i].choose_action(dist, epsilon, prune_actions=False)
+        return actions
+
+    def choose_batch_actions(self, states, masks, epsilon):
+        # Masked argmax of the learner's dists for a stack of states, with a random legal action at rate epsilon
+        dists = np.where(masks, np.array(self.learner.get_dists(states)), -np.inf)
+        actions = dists.argmax(axis=1)
+        for i in np.flatnonzero(np.random.random(len(actions)) < epsilon):
+            actions[i] = np.random.choice(np.flatnonzero(masks[i]))
+        return actions
+
+    def get_tactical_action(self, state, quad_forks=False):
+        if self.tactical_cache is None:
+            return self.find_tactical_action(state, quad_forks)
+        key = (self.sim_world.get_state_key(), quad_forks)
+        action = self.tactical_cache.get(key)
+        if action is MISSING:
+            action = self.find_tactical_action(state, quad_forks)
+            self.tactical_cache.put(key, action)
         return action
 
+    def find_tactical_action(self, state, quad_forks=False):
+        # Sim worlds with a tactical analyzer find the same action as the checks below in one pass
+        analyzer = self.sim_world.get_tactical_analyzer()
+        if analyzer:
+            index = analyzer.get_tactical_action(self.sim_world.get_current_encoded_state(), self.sim_world.get_current_player(), quad_forks)
+            return self.sim_world.get_action_space()[index] if index is not None else None
+        action = self.check_winning(state)
+        # print("Winning action", action)
+        if action:
+            return action
+        action = self.check_losing(state)
+        # print("Losing Action", action)
+        if action:
+            return action
+        action = self.check_winning_fork(state)
+        if action:
+            # print("Winning fork", action)
+            return action
+        action = self.check_losing_fork(state)
+        if action:
+            # print("Losing fork", action)
+            return action
+        if quad_forks:
+            action = self.check_winning_quad_fork(state)
+            if action:
+                # print("Winning Quad fork", action)
+                return action
+            action = self.check_loosing_quad_fork(state)
+            if action:
+                # print("Losing Quad fork", action)
+                return action
+        return None
+
+    def choose_action(self, dist, epsilon, prune_actions=True):
+        # Mask out actions that are illegal, or also the ones pruned by the sim world. Rollouts skip the pruning, it
+        # costs a pattern search over the whole board and is only worth it for the moves actually played or expanded
+        mask = self.sim_world.get_pruned_mask() if prune_actions else self.sim_world.get_legal_mask()
+
+        # Use a random allowed action based on epsilon value, otherwise the best allowed action of the dist
+        if random.random() < epsilon:
+            allowed = np.flatnonzero(mask)
+            index = allowed[random.randint(0, len(allowed) - 1)]
+        else:
+            index = np.where(mask, dist, -np.inf).argmax()
+        return self.sim_world.get_action_space()[index]
+
     def check_winning(self, state):
         player = self.sim_world.get_current_player()
         legal_actions = self.sim_world.get_legal_actions()
@@ -80,15 +167,13 @@ class Actor:
             reward = self.sim_world.get_reward()
             if reward == 1 and player or reward == -1 and not player:
                 found_action = action
-            self.sim_world.set_current_state(state, player)
-        # Reset back to original state
-        self.sim_world.set_current_state(state, player)
+            self.sim_world.undo_action()
         return found_action
 
     def check_losing(self, state):
         player = self.sim_world.get_current_player()
         opposite_player = not player
-        self.sim_world.set_current_state(self.sim_world.get_current_encoded_state(), opposite_player)
+        self.sim_world.set_current_player(opposite_player)
         legal_actions = self.sim_world.get_legal_actions()
         found_action = None
         for action in legal_actions:
@@ -96,9 +181,9 @@ class Actor:
             reward = self.sim_world.get_reward()
             if reward == 1 and opposite_player or reward == -1 and not opposite_player:
                 found_action = action
-            self.sim_world.set_current_state(state, opposite_player)
-        # Reset back to original state
-        self.sim_world.set_current_state(state, player)
+            self.sim_world.undo_action()
+        # Reset back to original player
+        self.sim_world.set_current_player(player)
         return found_action
 
     def check_winning_fork(self, state):
@@ -107,45 +192,43 @@ class Actor:
         found_fork_action = None
         for action in legal_actions:
             self.sim_world.perform_action(action)
-            temp_state = self.sim_world.get_current_encoded_state()
             won_count = 0
             for n_action in self.sim_world.bfs_tree_neighbors((action[0], action[1]), (1, 0) if player else (0, 1)):
-                self.sim_world.set_current_state(temp_state, player)
+                self.sim_world.set_current_player(player)
                 if n_action in legal_actions:   
                     self.sim_world.perform_action(n_action)
                     reward = self.sim_world.get_reward()
                     if reward == 1 and player or reward == -1 and not player:
                         won_count += 1
+                    self.sim_world.undo_action()
             if won_count >= 2:
                 found_fork_action = action
-            self.sim_world.set_current_state(state, player)
-        # Reset back to original state
-        self.sim_world.set_current_state(state, player)
+            self.sim_world.undo_action()
         return found_fork_action
 
     
     def check_losing_fork(self, state):
         player = self.sim_world.get_current_player()
         opposite_player = not player
-        self.sim_world.set_current_state(self.sim_world.get_current_encoded_state(), opposite_player)
+        self.sim_world.set_current_player(opposite_player)
         legal_actions = self.sim_world.get_legal_actions()
         found_fork_action = None
         for action in legal_actions:
             self.sim_world.perform_action(action)
-            temp_state = self.sim_world.get_current_encoded_state()
             lose_count = 0
             for n_action in self.sim_world.bfs_tree_neighbors((action[0], action[1]), (1, 0) if opposite_player else (0, 1)):
-                self.sim_world.set_current_state(temp_state, opposite_player)
+                self.sim_world.set_current_player(opposite_player)
                 if n_action in legal_actions:   
                     self.sim_world.perform_action(n_action)
                     reward = self.sim_world.get_reward()
                     if reward == 1 and opposite_player or reward == -1 and not opposite_player:
                         lose_count += 1
+                    self.sim_world.undo_action()
             if lose_count >= 2:
                 found_fork_action = action
-            self.sim_world.set_current_state(state, opposite_player)
-        # Reset back to original state
-        self.sim_world.set_current_state(state, player)
+            self.sim_world.undo_action()
+        # Reset back to original player
+        self.sim_world.set_current_player(player)
         return found_fork_action
 
     def check_winning_quad_fork(self, state):
@@ -154,54 +237,62 @@ class Actor:
         found_quad_fork_action = None
         for action in legal_actions:
             self.sim_world.perform_action(action)
-            temp_state = self.sim_world.get_current_encoded_state()
             fork_count = 0
             for n_action in self.sim_world.bfs_tree_neighbors((action[0], action[1]), (1, 0) if player else (0, 1)):
-                self.sim_world.set_current_state(temp_state, player)
+                self.sim_world.set_current_player(player)
                 if n_action in legal_actions:   
                     self.sim_world.perform_action(n_action)
+                    # Look for forks of the same player again, undo_action restores the turn afterwards
+                    self.sim_world.set_current_player(player)
                     fork_action = self.check_winning_fork(self.sim_world.get_current_encoded_state())
                     if fork_action:
                         fork_count += 1
+                    self.sim_world.undo_action()
             if fork_count >= 2:
                 found_quad_fork_action = action
-            self.sim_world.set_current_state(state, player)
-        # Reset back to original state
-        self.sim_world.set_current_state(state, player)
+            self.sim_world.undo_action()
         return found_quad_fork_action
 
     def check_loosing_quad_fork(self, state):
         player = self.sim_world.get_current_player()
         opposite_player = not player
-        self.sim_world.set_current_state(self.sim_world.get_current_encoded_state(), opposite_player)
+        self.sim_world.set_current_player(opposite_player)
         legal_actions = self.sim_world.get_legal_actions()
         found_quad_fork_action = None
         for action in legal_actions:
             self.sim_world.perform_action(action)
-            temp_state = self.sim_world.get_current_encoded_state()
             fork_count = 0
             for n_action in self.sim_world.bfs_tree_neighbors((action[0], action[1]), (1, 0) if opposite_player else (0, 1)):
-                self.sim_world.set_current_state(temp_state, opposite_player)
+                self.sim_world.set_current_player(opposite_player)
                 if n_action in legal_actions:   
                     self.sim_world.perform_action(n_action)
+                    self.sim_world.set_current_player(opposite_player)
                     fork_action = self.check_winning_fork(self.sim_world.get_current_encoded_state())
                     if fork_action:
                         fork_count += 1
+                    self.sim_world.undo_action()
             if fork_count >= 2:
                 found_quad_fork_action = action
-            self.sim_world.set_current_state(state, opposite_player)
-        # Reset back to original state
-        self.sim_world.set_current_state(state, player)
+            self.sim_world.undo_action()
+        # Reset back to original player
+        self.sim_world.set_current_player(player)
         return found_quad_fork_action
 
     def init_learner(self):
         self.learner.init_model()
+        self.learner_version += 1
 
     def train_learner(self, replay_buffer):
         self.learner.train_model(replay_buffer)
+        self.learner_version += 1
+
+    def set_learner_weights(self, weights):
+        self.learner.set_weights(weights)
+        self.learner_version += 1
 
     def load_learner(self, filepath):
         self.learner.load_model_from_file(filepath)
+        self.learner_version += 1
     
     def save_learner(self, filepath):
         self.learner.save_model_to_file(filepath)
@@ -0,0 +1,211 @@
+import numpy as np
+
+from mcts import MCTS_Parameters, MonteCarloTreeSearchBase, exploration_bonus
+from simworlds.simworld import SimWorld
+from tree_node import TreeNode
+
+
+class ArrayMonteCarloTreeSearch(MonteCarloTreeSearchBase):
+    """
+    MonteCarloTreeSearch with the tree stored as a struct of NumPy arrays.
+
+    Nodes are integer ids with one node per state, so transpositions share a node like in
+    the dict based search. The outgoing edges of a node are a contiguous range of the edge
+    arrays starting at first_edge, and hold the child id, action index and statistics of
+    each edge, so both searches produce the same distributions from move_next_root.
+    """
+
+    def __init__(self, sim_world: SimWorld, params: MCTS_Parameters = None):
+        self.sim_world = sim_world
+        self.params = params if params else MCTS_Parameters()
+        self.action_space = self.sim_world.get_action_space()
+
+        # Node arrays
+        self.node_capacity = self.params.capacity
+        self.node_count = 0
+        self.node_ids = {}
+        self.node_keys = []
+        self.node_encoded = []
+        self.node_visits = np.zeros(self.node_capacity, dtype=np.int64)
+        self.node_player = np.zeros(self.node_capacity, dtype=bool)
+        self.first_edge = np.full(self.node_capacity, -1, dtype=np.int64)
+        self.edge_count = np.zeros(self.node_capacity, dtype=np.int64)
+
+        # Edge arrays
+        self.edge_capacity = self.params.capacity
+        self.edge_total = 0
+        self.edge_child = np.zeros(self.edge_capacity, dtype=np.int64)
+        self.edge_action = np.zeros(self.edge_capacity, dtype=np.int64)
+        self.edge_visits = np.zeros(self.edge_capacity, dtype=np.int64)
+        self.edge_values = np.zeros(self.edge_capacity, dtype=np.float64)
+
+        self.root = self.node_id(self.sim_world.get_state_key())
+        self.reclaimed = (0, 0)
+        self.lane_worlds = []
+
+    def grow_nodes(self):
+        extra = self.node_capacity
+        self.node_visits = np.concatenate((self.node_visits, np.zeros(extra, dtype=np.int64)))
+        self.node_player = np.concatenate((self.node_player, np.zeros(extra, dtype=bool)))
+        self.first_edge = np.concatenate((self.first_edge, np.full(extra, -1, dtype=np.int64)))
+        self.edge_count = np.concatenate((self.edge_count, np.zeros(extra, dtype=np.int64)))
+        self.node_capacity += extra
+
+    def grow_edges(self, required):
+        capacity = self.edge_capacity
+        while capacity < required:
+            capacity *= 2
+        extra = capacity - self.edge_capacity
+        self.edge_child = np.concatenate((self.edge_child, np.zeros(extra, dtype=np.int64)))
+        self.edge_action = np.concatenate((self.edge_action, np.zeros(extra, dtype=np.int64)))
+        self.edge_visits = np.concatenate((self.edge_visits, np.zeros(extra, dtype=np.int64)))
+        self.edge_values = np.concatenate((self.edge_values, np.zeros(extra, dtype=np.float64)))
+        self.edge_capacity = capacity
+
+    def node_id(self, key):
+        # Look up the node of the sim world's current state, creating it if it is new
+        node = self.node_ids.get(key)
+        if node is None:
+            if self.node_count == self.node_capacity:
+                self.grow_nodes()
+            node = self.node_count
+            self.node_ids[key] = node
+            self.node_keys.append(key)
+            self.node_encoded.append(self.sim_world.get_current_encoded_state())
+            self.node_player[node] = self.sim_world.get_current_player()
+            self.node_count += 1
+        return node
+
+    def node_view(self, node, action_index=-1):
+        prev_action = self.action_space[action_index] if action_index >= 0 else None
+        return TreeNode(self.node_encoded[node], bool(self.node_player[node]), None, prev_action)
+
+    def root_state(self):
+        return self.node_encoded[self.root], bool(self.node_player[self.root])
+
+    def move_next_root(self):
+        edges = slice(self.first_edge[self.root], self.first_edge[self.root] + self.edge_count[self.root])
+        dist = np.zeros(len(self.action_space))
+        dist[self.edge_action[edges]] = self.edge_visits[edges] / self.node_visits[self.root]
+        dist = dist.tolist()
+        best_index = dist.index(max(dist))
+        print(np.array(self.node_encoded[self.root])[None], np.array(dist)[None])
+        print(self.node_visits[self.root])
+        best_edge = edges.start + int(np.flatnonzero(self.edge_action[edges] == best_index)[0])
+        self.set_root(int(self.edge_child[best_edge]))
+        return self.node_view(self.root, best_index), dist
+
+    def get_root(self):
+        return self.node_view(self.root)
+
+    def get_root_visits(self):
+        edges = slice(self.first_edge[self.root], self.first_edge[self.root] + self.edge_count[self.root])
+        actions = [self.action_space[index] for index in self.edge_action[edges]]
+        return int(self.node_visits[self.root]), dict(zip(actions, self.edge_visits[edges].tolist()))
+
+    def manual_set_root(self, state):
+        self.sim_world.set_current_state(state, bool(state[len(state) - 1]))
+        node = self.node_id(self.sim_world.get_state_key())
+        if node != self.root:
+            self.set_root(node)
+
+    def set_root(self, node):
+        # Keep the statistics below the new root and compact everything else out of the arrays
+        self.root = node
+        self.reclaimed = self.prune()
+        print("Reclaimed nodes, edges:", self.reclaimed)
+
+    def prune(self):
+        reachable = np.zeros(self.node_count, dtype=bool)
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if not reachable[node]:
+                reachable[node] = True
+                first = self.first_edge[node]
+                stack.extend(self.edge_child[first:first + self.edge_count[node]].tolist())
+        kept = np.flatnonzero(reachable)
+        remap = np.full(self.node_count, -1, dtype=np.int64)
+        remap[kept] = np.arange(len(kept))
+
+        # Gather the edge ranges of the kept nodes and lay them out contiguously again
+        counts = self.edge_count[kept]
+        firsts = self.first_edge[kept]
+        kept_edges = np.concatenate([np.arange(first, first + count) for first, count in zip(firsts, counts) if count] + [np.zeros(0, dtype=np.int64)])
+        new_first = np.where(counts > 0, np.cumsum(counts) - counts, -1)
+
+        freed = (self.node_count - len(kept), self.edge_total - len(kept_edges))
+        for name in ("node_visits", "node_player", "edge_count"):
+            array = getattr(self, name)
+            array[:len(kept)] = array[kept]
+            array[len(kept):] = 0
+        self.first_edge[:len(kept)] = new_first
+        self.first_edge[len(kept):] = -1
+        self.edge_child[:len(kept_edges)] = remap[self.edge_child[kept_edges]]
+        for name in ("edge_action", "edge_visits", "edge_values"):
+            array = getattr(self, name)
+            array[:len(kept_edges)] = array[kept_edges]
+            array[len(kept_edges):] = 0
+        self.node_keys = [self.node_keys[node] for node in kept]
+        self.node_encoded = [self.node_encoded[node] for node in kept]
+        self.node_ids = {key: node for node, key in enumerate(self.node_keys)}
+        self.node_count = len(kept)
+        self.edge_total = len(kept_edges)
+        self.root = int(remap[self.root])
+        return freed
+
+    def select_edge(self, node):
+        edges = slice(self.first_edge[node], self.first_edge[node] + self.edge_count[node])
+        child_visits = self.node_visits[self.edge_child[edges]]
+        bonus = exploration_bonus(child_visits, self.edge_visits[edges])
+        if self.node_player[node]:
+            return edges.start + int(np.argmax(self.edge_values[edges] + bonus))
+        return edges.start + int(np.argmin(self.edge_values[edges] - bonus))
+
+    def tree_search(self, root):
+        path = [root]
+        edges = []
+        node = root
+        while self.edge_count[node]:
+            edge = self.select_edge(node)
+            self.sim_world.perform_action(self.action_space[self.edge_action[edge]])
+            node = int(self.edge_child[edge])
+            path.append(node)
+            edges.append(edge)
+        return path, edges
+
+    def node_expansion(self, node):
+        legal_actions = self.sim_world.get_pruned_actions()
+        if self.edge_total + len(legal_actions) > self.edge_capacity:
+            self.grow_edges(self.edge_total + len(legal_actions))
+        self.first_edge[node] = self.edge_total
+        self.edge_count[node] = len(legal_actions)
+        for action in legal_actions:
+            self.sim_world.perform_action(action)
+            self.edge_child[self.edge_total] = self.node_id(self.sim_world.get_state_key())
+            self.edge_action[self.edge_total] = self.sim_world.get_action_index(action)
+            self.edge_total += 1
+            self.sim_world.undo_action()
+
+    def first_step(self, path, edges, action):
+        leaf_node = path[-1]
+        leaf_edges = slice(self.first_edge[leaf_node], self.first_edge[leaf_node] + self.edge_count[leaf_node])
+        matches = np.flatnonzero(self.edge_action[leaf_edges] == self.sim_world.get_action_index(action))
+        if len(matches):
+            edge = leaf_edges.start + int(matches[0])
+            return path + [int(self.edge_child[edge])], edges + [edge]
+        return path, edges
+
+    def add_visits(self, path, edges, count):
+        self.node_visits[path] += count
+        self.edge_visits[edges] += count
+
+    def backpropagation(self, path, edges, reward):
+        for i in range(len(path) - 1, -1, -1):
+            node = path[i]
+            self.node_visits[node] += 1
+            if i < len(edges):
+                edge = edges[i]
+                visits = self.node_visits[node]
+                self.edge_values[edge] = (self.edge_values[edge] * (visits - 1) + reward) / visits
+                self.edge_visits[edge] += 1
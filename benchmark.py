@@ -0,0 +1,36 @@
+import time
+from actor import Actor
+from learners.dtrees import DecisionTrees, DecisionTreesParams
+from mcts import MCTS_Parameters
+from search import new_mcts
+from simworlds.hex_bitboard import BitboardHexGame
+
+
+def benchmark_search(mcts_params: MCTS_Parameters, search_games, board_size=7, moves=3):
+    sim_world = BitboardHexGame(board_size)
+    learner = DecisionTrees(DecisionTreesParams(len(sim_world.get_action_space())))
+    actor = Actor(sim_world, learner)
+    actor.init_learner()
+    mcts = new_mcts(sim_world, mcts_params)
+    # An untimed search game first, so starting the worker processes isn't counted in the rate
+    mcts.run_search(actor, 0.1, 1)
+    t = time.time()
+    for _ in range(moves):
+        mcts.run_search(actor, 0.1, search_games)
+        root, dist = mcts.move_next_root()
+        sim_world.set_current_state(root.state, root.player)
+    d = time.time() - t
+    mcts.close()
+    return moves * search_games / d
+
+
+if __name__ == "__main__":
+    search_games = 200
+    serial = benchmark_search(MCTS_Parameters(tree="array"), search_games)
+    results = [("serial", serial)]
+    for workers in (2, 4, 8):
+        results.append((f"tree x{workers}", benchmark_search(MCTS_Parameters(tree="array", workers=workers, parallel="tree"), search_games)))
+        results.append((f"root x{workers}", benchmark_search(MCTS_Parameters(tree="array", workers=workers, parallel="root"), search_games)))
+    print()
+    for name, rate in results:
+        print(f"{name}: {rate:.1f} search games/s ({rate / serial:.2f}x)")
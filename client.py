@@ -6,7 +6,7 @@ from visualizer import Visualizer
 from ActorClient import ActorClient
 class MyClient(ActorClient):
 
-    def __init__(self, actor: Actor, visualize=True, frame_delay=0.01, search_games=0, search_games_delay=0, auth="", qualify=False):
+    def __init__(self, actor: Actor, visualize=True, frame_delay=0.01, search_games=0, search_games_delay=0, time_limit=0, auth="", qualify=False, quad_forks=False):
         super().__init__(auth=auth, qualify=qualify)
         self.actor = actor
         self.is_start_player = False
@@ -14,6 +14,8 @@ class MyClient(ActorClient):
         self.my_series_id = 1
         self.search_games = search_games
         self.search_games_delay = search_games_delay
+        self.time_limit = time_limit
+        self.quad_forks = quad_forks
         self.move_count = 0
         self.visualizer = Visualizer(self.actor.sim_world, frame_delay=frame_delay)
         self.visualizer.set_visualize(visualize)
@@ -52,9 +54,10 @@ class MyClient(ActorClient):
         self.actor.sim_world.set_current_state(flipped_encoded_state if self.my_series_id == 1 else encoded_state, True)
         self.visualizer.visualize_state()
         search_games = self.search_games if self.move_count > self.search_games_delay else 0
+        time_limit = self.time_limit if self.move_count > self.search_games_delay else 0
         check_reward = self.move_count >= 7 and self.move_count <= self.search_games_delay
         epsilon = 1 if self.move_count <= 4 else 0
-        row, col = self.actor.get_action(self.actor.sim_world.get_current_encoded_state(), epsilon, mcts_episodes=search_games, check_reward=check_reward) # Your logic
+        row, col = self.actor.get_action(self.actor.sim_world.get_current_encoded_state(), epsilon, mcts_episodes=search_games, check_reward=check_reward, time_limit=time_limit, quad_forks=self.quad_forks) # Your logic
         self.move_count += 1
         # Flip col and row if we are red (id == 1) externaly
         result = (col, row) if self.my_series_id == 1 else (row, col)
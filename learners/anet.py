@@ -1,24 +1,32 @@
+import time
 import tensorflow as tf
 import numpy as np
 from keras.models import load_model
 
 from learners.learner import Learner
+from learners.numpy_net import NumpyNetwork
 
 class ANET_Parameters(Learner):
     
-    def __init__(self, input_shape, action_space, dimensions, learning_rate, activation="softmax", optimizer="SGD"):
+    def __init__(self, input_shape, action_space, dimensions, learning_rate, activation="softmax", optimizer="SGD", inference="numpy", inference_dtype="float32", batch_size=32, epochs=1, train_samples=0):
         self.dimensions = dimensions
         self.input_shape = input_shape
         self.action_space = action_space
         self.learning_rate = learning_rate
         self.activation = activation
         self.optimizer = optimizer
+        self.inference = inference
+        self.inference_dtype = inference_dtype
+        self.batch_size = batch_size
+        self.epochs = epochs
+        self.train_samples = train_samples
 
 class ActorNeuralNetwork:
 
     def __init__(self, params: ANET_Parameters):
         self.params = params
         self.model = None
+        self.net = None
 
     def init_model(self):
         layers = []
@@ -44,20 +52,48 @@ class ActorNeuralNetwork:
             metrics=["accuracy"]
         )
         self.model.summary()
+        self.export_net()
 
     def train_model(self, replay_buffer):
-        states = np.array(list(map(lambda b: b[0], replay_buffer)))
-        dists = np.array(list(map(lambda b: b[1], replay_buffer)))
-        for i in range(len(states)):
-            print(states[i][None], dists[i][None])
-            self.model.fit(states[i][None], dists[i][None])
+        # Train on a sample of the buffer when train_samples is set, so training time stops growing with the buffer
+        if not len(replay_buffer):
+            return
+        if self.params.train_samples:
+            states, dists = replay_buffer.sample(self.params.train_samples)
+        else:
+            states, dists = replay_buffer.get_states(), replay_buffer.get_dists()
+        t = time.time()
+        self.model.fit(states, dists, batch_size=self.params.batch_size, epochs=self.params.epochs, shuffle=True, verbose=0)
+        elapsed = time.time() - t
+        print(f"Trained on {len(states)} samples x {self.params.epochs} epochs in {elapsed:.3f}s ({len(states) * self.params.epochs / elapsed:.0f} samples/s)")
+        self.export_net()
+
+    def export_net(self):
+        # Play with a NumPy copy of the weights, training stays in TensorFlow
+        self.net = NumpyNetwork(self.model, self.params.inference_dtype) if self.params.inference == "numpy" else None
     
     def get_dist(self, state):
         # print("get_dist:", np.array(state)[None])
+        if self.net:
+            return self.net.predict(np.array(state)[None]).tolist()[0]
         return self.model(np.array(state)[None]).numpy().tolist()[0]
 
+    def get_dists(self, states):
+        # One model call for the whole stack of states
+        if self.net:
+            return self.net.predict(np.array(states)).tolist()
+        return self.model(np.array(states)).numpy().tolist()
+
+    def get_weights(self):
+        return self.model.get_weights()
+
+    def set_weights(self, weights):
+        self.model.set_weights(weights)
+        self.export_net()
+
     def save_model_to_file(self, filepath):
         self.model.save(f"{filepath}/model.h5")
     
     def load_model_from_file(self, filepath):
         self.model = load_model(f"{filepath}/model.h5")
+        self.export_net()
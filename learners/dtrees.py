@@ -2,6 +2,7 @@
 import os
 import numpy as np
 from learners.learner import Learner
+from sklearn.ensemble import RandomForestRegressor
 from sklearn.tree import DecisionTreeRegressor
 import sklearn
 import random
@@ -9,28 +10,70 @@ import pickle
 
 class DecisionTreesParams:
 
-    def __init__(self, tree_count):
+    def __init__(self, tree_count, multi_output=False, forest_size=0, incremental=False, trees_per_update=4, max_trees=64, recent_samples=2048):
         self.tree_count = tree_count
+        # multi_output fits one model predicting the whole dist, a forest of forest_size trees if set, else a single tree
+        self.multi_output = multi_output or incremental
+        self.forest_size = forest_size
+        # incremental grows one forest by trees_per_update trees fitted on the recent_samples newest samples per update,
+        # keeping at most max_trees of the newest trees
+        self.incremental = incremental
+        self.trees_per_update = trees_per_update
+        self.max_trees = max_trees
+        self.recent_samples = recent_samples
 
 class DecisionTrees(Learner):
 
     def __init__(self, params : DecisionTreesParams):
         self.params = params
         self.tree_count = params.tree_count
+        # Whether self.models holds one model for the whole dist, which follows the saved format after a load
+        self.multi_output = params.multi_output
         self.models = []
 
     def init_model(self):
+        self.multi_output = self.params.multi_output
+        if self.params.incremental:
+            self.models = [RandomForestRegressor(n_estimators=0, warm_start=True)]
+            return
+        if self.multi_output:
+            if self.params.forest_size:
+                self.models = [RandomForestRegressor(n_estimators=self.params.forest_size, random_state=0)]
+            else:
+                self.models = [DecisionTreeRegressor(random_state=0)]
+            return
         self.models = [DecisionTreeRegressor(random_state=0) for _ in range(self.tree_count)]
     
     def train_model(self, replay_buffer):
-        states = np.array(list(map(lambda b: b[0], replay_buffer)))
-        dists = np.array(list(map(lambda b: b[1], replay_buffer)))
+        if self.params.incremental and self.multi_output:
+            self.train_incremental(replay_buffer)
+            return
+        states = replay_buffer.get_states()
+        dists = replay_buffer.get_dists()
+        if self.multi_output:
+            self.models[0].fit(states, dists)
+            return
         for i in range(self.tree_count):
-            labels = list(map(lambda d: d[i], dists))
+            labels = dists[:, i]
             # print(states, labels)
             self.models[i].fit(states, labels)
 
+    def train_incremental(self, replay_buffer):
+        # Every update fits the same number of trees on the same number of samples, so its cost does not grow with the buffer
+        if not len(replay_buffer):
+            return
+        forest = self.models[0]
+        kept = self.params.max_trees - self.params.trees_per_update
+        trees = getattr(forest, "estimators_", [])
+        if len(trees) > kept:
+            forest.estimators_ = trees[len(trees) - kept:] if kept > 0 else []
+        forest.n_estimators = len(getattr(forest, "estimators_", [])) + self.params.trees_per_update
+        states, dists = replay_buffer.get_recent(self.params.recent_samples)
+        forest.fit(states, dists)
+
     def get_dist(self, state):
+        if self.multi_output:
+            return self.get_dists([state])[0]
         dist = []
         for model in self.models:
             try:
@@ -40,9 +83,36 @@ class DecisionTrees(Learner):
         # print(state, dist)
         return dist
 
+    def get_dists(self, states):
+        if self.multi_output:
+            try:
+                return self.models[0].predict(states).tolist()
+            except sklearn.exceptions.NotFittedError:
+                return [[random.random() for _ in range(self.tree_count)] for _ in states]
+        # One predict call per tree for the whole batch, each tree gives one column of the dists
+        columns = []
+        for model in self.models:
+            try:
+                columns.append(model.predict(states))
+            except sklearn.exceptions.NotFittedError:
+                columns.append([random.random() for _ in states])
+        return np.array(columns).T.tolist()
+
+    def get_weights(self):
+        # The fitted trees are the weights, they are pickled when sent to another process
+        return self.models
+
+    def set_weights(self, weights):
+        self.models = list(weights)
+        self.multi_output = len(self.models) != self.tree_count
+
     def save_model_to_file(self, filepath):
         fullpath = os.getcwd() + filepath[1:].replace("/", os.sep)
         os.makedirs(fullpath, exist_ok=True)
+        if self.multi_output:
+            with open(f"{fullpath}{os.sep}model.pickle", "wb") as f:
+                pickle.dump(self.models[0], f)
+            return
         for i in range(self.tree_count):
             with open(f"{fullpath}{os.sep}{i}.pickle", "wb") as f:
                 pickle.dump(self.models[i], f)
@@ -50,6 +120,12 @@ class DecisionTrees(Learner):
     def load_model_from_file(self, filepath):
         self.models = []
         fullpath = os.getcwd() + filepath[1:].replace("/", os.sep)
+        # Load whichever format the model was saved in, runs saved before multi_output have one pickle per action
+        self.multi_output = os.path.exists(f"{fullpath}{os.sep}model.pickle")
+        if self.multi_output:
+            with open(f"{fullpath}{os.sep}model.pickle", "rb") as f:
+                self.models.append(pickle.load(f))
+            return
         for i in range(self.tree_count):
             with open(f"{fullpath}{os.sep}{i}.pickle", "rb") as f:
                 self.models.append(pickle.load(f))
\ No newline at end of file
@@ -7,5 +7,8 @@ class Learner:
     def init_model(self): pass
     def train_model(self, replay_buffer): pass
     def get_dist(self, state): pass
+    def get_dists(self, states): return [self.get_dist(state) for state in states]
+    def get_weights(self): pass
+    def set_weights(self, weights): pass
     def save_model_to_file(self, filepath): pass
     def load_model_from_file(self, filepath): pass
\ No newline at end of file
@@ -0,0 +1,53 @@
+import numpy as np
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def softmax(x):
+    exp = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def linear(x):
+    return x
+
+
+ACTIVATIONS = {
+    "relu": relu,
+    "softmax": softmax,
+    "sigmoid": sigmoid,
+    "tanh": np.tanh,
+    "linear": linear,
+}
+
+
+class NumpyNetwork:
+    """
+    Forward pass of a trained Keras Sequential model of Dense layers in plain NumPy.
+
+    The weights are copied out of the model once, so the network has to be exported again
+    after the model is trained.
+    """
+
+    def __init__(self, model, dtype="float32"):
+        self.dtype = np.dtype(dtype)
+        self.layers = []
+        for layer in model.layers:
+            weights, bias = layer.get_weights()
+            activation = layer.get_config()["activation"]
+            if activation not in ACTIVATIONS:
+                raise ValueError(f"Unsupported activation for NumPy inference: {activation}")
+            self.layers.append((weights.astype(self.dtype), bias.astype(self.dtype), ACTIVATIONS[activation]))
+
+    def predict(self, states):
+        # states is a batch of encoded states, one per row
+        x = np.asarray(states, dtype=self.dtype)
+        for weights, bias, activation in self.layers:
+            x = activation(x @ weights + bias)
+        return x
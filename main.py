@@ -3,62 +3,79 @@ from client import MyClient
 from learners.anet import ANET_Parameters, ActorNeuralNetwork
 from learners.dtrees import DecisionTrees, DecisionTreesParams
 from learners.learner import Learner
+from mcts import MCTS_Parameters
+from replay_buffer import ReplayBufferParams
 from rl import RLSystem
 from simworlds.hex import HexGame
+from simworlds.hex_bitboard import BitboardHexGame
 from simworlds.nim import Nim
 from simworlds.simworld import SimWorld
 from topp import TOPP
 
-file = open("params.json")
-params = json.load(file)
-file.close()
+if __name__ == "__main__":
+    file = open("params.json")
+    params = json.load(file)
+    file.close()
 
-sim_world = SimWorld()
-sw_name = params["simworld"]
-sw_params = params["simworld_params"]
-if sw_name == "nim":
-    nim_params = sw_params["nim"]
-    sim_world = Nim(nim_params["start"], nim_params["max_move"], True)
-elif sw_name == "hex":
-    hex_params = sw_params["hex"]
-    sim_world = HexGame(hex_params["board_size"])
+    sim_world = SimWorld()
+    sw_name = params["simworld"]
+    sw_params = params["simworld_params"]
+    if sw_name == "nim":
+        nim_params = sw_params["nim"]
+        sim_world = Nim(nim_params["start"], nim_params["max_move"], True)
+    elif sw_name == "hex":
+        hex_params = sw_params["hex"]
+        if hex_params["backend"] == "bitboard":
+            sim_world = BitboardHexGame(hex_params["board_size"], hex_params["prune_actions"])
+        else:
+            sim_world = HexGame(hex_params["board_size"], hex_params["prune_actions"])
 
-learner = Learner()
-learner_name = params["learner"]
-learner_params = params["learner_params"]
-if learner_name == "anet":
-    anet_params = learner_params["anet"]
-    anet_params = ANET_Parameters(sim_world.get_encoding_shape(), sim_world.get_action_space(), anet_params["dimensions"], anet_params["learning_rate"], anet_params["activation"], anet_params["optimizer"])
-    learner = ActorNeuralNetwork(anet_params)
-elif learner_name == "dtrees":
-    dtrees_params = DecisionTreesParams(len(sim_world.get_action_space()))
-    learner = DecisionTrees(dtrees_params)
+    learner = Learner()
+    learner_name = params["learner"]
+    learner_params = params["learner_params"]
+    if learner_name == "anet":
+        anet_params = learner_params["anet"]
+        anet_params = ANET_Parameters(sim_world.get_encoding_shape(), sim_world.get_action_space(), anet_params["dimensions"], anet_params["learning_rate"], anet_params["activation"], anet_params["optimizer"], anet_params["inference"], anet_params["inference_dtype"], anet_params["batch_size"], anet_params["epochs"], anet_params["train_samples"])
+        learner = ActorNeuralNetwork(anet_params)
+    elif learner_name == "dtrees":
+        dtrees_params = learner_params["dtrees"]
+        dtrees_params = DecisionTreesParams(len(sim_world.get_action_space()), dtrees_params["multi_output"], dtrees_params["forest_size"], dtrees_params["incremental"], dtrees_params["trees_per_update"], dtrees_params["max_trees"], dtrees_params["recent_samples"])
+        learner = DecisionTrees(dtrees_params)
 
-topp = TOPP(sim_world, params["TOPP_players"], params["TOPP_games"], params["episodes"], params["search_games"], params["TOPP_search_games"], params["TOPP_search_game_delay"], learner, train_visualize=params["train_visualize"], tournament_visualize=params["TOPP_visualize"], frame_delay=params["frame_delay"], train_epsilon=params["epsilon"])
+    mcts_params = params["mcts_params"]
+    mcts_params = MCTS_Parameters(mcts_params["tree"], mcts_params["capacity"], mcts_params["table_capacity"], mcts_params["eviction"], mcts_params["workers"], mcts_params["parallel"], mcts_params["virtual_loss"], mcts_params["batch_size"])
 
+    replay_params = params["replay_params"]
+    replay_params = ReplayBufferParams(replay_params["capacity"], replay_params["sampling"])
 
-if params["train_enabled"] and params["TOPP_restore_players"]:
-    topp.restore_rl_trainer(params["TOPP_restore_players"], train_opponent=params["train_opponent"])
+    topp = TOPP(sim_world, params["TOPP_players"], params["TOPP_games"], params["episodes"], params["search_games"], params["TOPP_search_games"], params["TOPP_search_game_delay"], learner, topp_time_limit=params["TOPP_time_limit"], train_visualize=params["train_visualize"], tournament_visualize=params["TOPP_visualize"], frame_delay=params["frame_delay"], train_epsilon=params["epsilon"], mcts_params=mcts_params, replay_params=replay_params, augment=params["augment_symmetries"], self_play_workers=params["self_play_workers"], weight_refresh=params["weight_refresh_interval"], batch_games=params["batch_games"], topp_batch=params["TOPP_batch"], quad_forks=params["quad_forks"], cache_size=params["cache_size"], topp_workers=params["TOPP_workers"])
 
-if params["train_enabled"]:
-    topp.train_players()
-    topp.save_params(params)
 
-# Ids: 1648719880, 1648720704, 1648721304, 1648731768, 1648732720, 1649060090
-if params["TOPP_restore_players"]:
-    topp.restore_trained_players(params["TOPP_restore_players"])
+    if params["train_enabled"] and params["TOPP_restore_players"]:
+        topp.restore_rl_trainer(params["TOPP_restore_players"], train_opponent=params["train_opponent"])
 
-if params["TOPP_enabled"]:
-    topp.play_tournament()
+    if params["train_enabled"]:
+        topp.train_players()
+        topp.save_params(params)
 
-oht_mode = params["OHT_mode"]
-if oht_mode:
-    topp_id = params["TOPP_restore_players"]
-    actor = topp.restore_actor_from_dir(f"./topp/{topp_id}", params["OHT_actor"])
-    client = MyClient(actor, auth=params["OHT_auth"], qualify=params["OHT_qualify"], visualize=params["OHT_visualize"], search_games=params["TOPP_search_games"], search_games_delay=params["TOPP_search_game_delay"])
-    client.run(mode=params["OHT_mode"])
+    # Ids: 1648719880, 1648720704, 1648721304, 1648731768, 1648732720, 1649060090
+    if params["TOPP_restore_players"]:
+        topp.restore_trained_players(params["TOPP_restore_players"])
 
+    if params["TOPP_enabled"]:
+        topp.play_tournament()
 
+    oht_mode = params["OHT_mode"]
+    if oht_mode:
+        topp_id = params["TOPP_restore_players"]
+        actor = topp.restore_actor_from_dir(f"./topp/{topp_id}", params["OHT_actor"])
+        client = MyClient(actor, auth=params["OHT_auth"], qualify=params["OHT_qualify"], visualize=params["OHT_visualize"], search_games=params["TOPP_search_games"], search_games_delay=params["TOPP_search_game_delay"], time_limit=params["TOPP_time_limit"], quad_forks=params["quad_forks"])
+        try:
+            client.run(mode=params["OHT_mode"])
+        finally:
+            actor.close()
 
-# rl = RLSystem(sim_world)
-# rl.run_episodes(20, 1000)
\ No newline at end of file
+
+
+    # rl = RLSystem(sim_world)
+    # rl.run_episodes(20, 1000)
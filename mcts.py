@@ -1,129 +1,248 @@
 
-from math import log, sqrt
+import copy
 import math
+import time
 import numpy as np
 
 from simworlds.simworld import SimWorld
+from transposition_table import TranspositionTable
 from tree_node import TreeNode
 
 
-class MonteCarloTreeSearch:
+def exploration_bonus(child_visits, edge_visits, c=1):
+    # Children visited at most once get an infinite bonus, so they are always tried first
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bonus = c * np.sqrt(np.log(child_visits) / (1 + edge_visits))
+    bonus[child_visits <= 1] = math.inf
+    return bonus
+
+
+def run_search_games(run_search_batch, search_games, time_limit=0, batch_size=1):
+    # Run batches of search games until search_games are done or time_limit seconds have passed, whichever limit is set and hit first
+    t = time.time()
+    count = 0
+    if not search_games and not time_limit:
+        return count, 0
+    while (not search_games or count < search_games) and (not time_limit or time.time() - t < time_limit):
+        games = min(batch_size, search_games - count) if search_games else batch_size
+        run_search_batch(games)
+        count += games
+    return count, time.time() - t
+
+
+def run_batched_search_games(mcts, actor, epsilon, games):
+    # Select and expand a leaf for every lane first. A pending lane counts as two visits along its path, where the
+    # exploration bonus turns finite, so later lanes spread out instead of descending into the same unvisited child
+    while len(mcts.lane_worlds) < games:
+        mcts.lane_worlds.append(copy.deepcopy(mcts.sim_world))
+    lanes = []
+    for lane_world in mcts.lane_worlds[:games]:
+        mcts.start_search_game()
+        path, edges = mcts.tree_search(mcts.root)
+        mcts.node_expansion(path[-1])
+        mcts.add_visits(path, edges, 2)
+        lane_world.set_current_state(mcts.sim_world.get_current_encoded_state(), mcts.sim_world.get_current_player())
+        lanes.append([actor.for_sim_world(lane_world), path, edges, path, edges])
+
+    # Play the rollouts in lockstep, so the learner is queried once per step for all lanes
+    active = [lane for lane in lanes if not lane[0].sim_world.is_final_state()]
+    first_step = True
+    while active:
+        actions = actor.get_batch_actions([lane[0] for lane in active], epsilon)
+        for lane, action in zip(active, actions):
+            if first_step:
+                lane[3], lane[4] = mcts.first_step(lane[1], lane[2], action)
+            lane[0].sim_world.perform_action(action)
+        first_step = False
+        active = [lane for lane in active if not lane[0].sim_world.is_final_state()]
+
+    for lane_actor, path, edges, rollout_path, rollout_edges in lanes:
+        mcts.add_visits(path, edges, -2)
+        mcts.backpropagation(rollout_path, rollout_edges, lane_actor.sim_world.get_reward())
+    mcts.end_search_game()
+
+
+class MCTS_Parameters:
+
+    def __init__(self, tree="dict", capacity=4096, table_capacity=0, eviction="lru", workers=1, parallel="root", virtual_loss=1, batch_size=1):
+        self.tree = tree
+        self.capacity = capacity
+        self.table_capacity = table_capacity
+        self.eviction = eviction
+        self.workers = workers
+        self.parallel = parallel
+        self.virtual_loss = virtual_loss
+        self.batch_size = batch_size
+
+class MonteCarloTreeSearchBase:
+    """
+    The search game loop shared by the dict and array trees.
+
+    A search game selects a leaf with tree_search, expands it, plays a rollout from it with
+    the actor and backpropagates the reward. Subclasses store the tree and provide
+    root_state, tree_search, node_expansion, first_step, add_visits and backpropagation.
+    """
+
+    def run_search(self, actor, epsilon, search_games, time_limit=0):
+        count, elapsed = run_search_games(lambda games: self.run_search_batch(actor, epsilon, games), search_games, time_limit, self.params.batch_size)
+        print(f"Search games: {count} in {elapsed:.3f}s")
+        return count, elapsed
+
+    def run_search_batch(self, actor, epsilon, games):
+        if games == 1:
+            self.run_search_game(actor, epsilon)
+        else:
+            run_batched_search_games(self, actor, epsilon, games)
+
+    def run_search_game(self, actor, epsilon):
+        self.start_search_game()
+        path, edges = self.tree_search(self.root)
+        self.node_expansion(path[-1])
+        path, edges = self.leaf_evaluation(path, edges, actor, epsilon)
+        self.backpropagation(path, edges, self.sim_world.get_reward())
+        self.end_search_game()
+
+    def start_search_game(self):
+        # The sim world follows the search down the tree, so each stage starts from the node the previous one ended on
+        self.sim_world.set_current_state(*self.root_state())
+
+    def end_search_game(self): pass
+
+    def close(self): pass
+
+    def leaf_evaluation(self, path, edges, actor, epsilon=0):
+        # Rollout to final state, only the first step from the leaf is kept in the tree
+        first_step = True
+        while not self.sim_world.is_final_state():
+            action = actor.get_action(self.sim_world.get_current_encoded_state(), epsilon, prune_actions=False)
+            if first_step:
+                path, edges = self.first_step(path, edges, action)
+            first_step = False
+            self.sim_world.perform_action(action)
+        return path, edges
+
+
+class MonteCarloTreeSearch(MonteCarloTreeSearchBase):
 
-    def __init__(self, sim_world: SimWorld):
+    def __init__(self, sim_world: SimWorld, params: MCTS_Parameters = None):
         self.sim_world = sim_world
-        self.node_visits = {}
-        self.edge_visits = {}
-        self.tree_policy = {}
-        self.nodes = {}
-        self.root = TreeNode(self.sim_world.get_current_encoded_state(), self.sim_world.get_current_player(), None, None)
-        self.nodes[self.root.state] = self.root
+        self.params = params if params else MCTS_Parameters()
+        self.table = TranspositionTable(self.params.table_capacity, self.params.eviction)
+        self.root = TreeNode(self.sim_world.get_current_encoded_state(), self.sim_world.get_current_player(), None, None, key=self.sim_world.get_state_key())
+        self.table.put(self.root)
+        self.reclaimed = (0, 0)
+        self.lane_worlds = []
 
-    def run_search_game(self, actor, epsilon):
-        self.sim_world.set_current_state(self.root.state, self.root.player)
-        leaf_node = self.tree_search(self.root)
-        self.node_expansion(leaf_node)
-        final_node = self.leaf_evaluation(leaf_node, actor, epsilon)
-        self.backpropagation(final_node)
+    def root_state(self):
+        return self.root.state, self.root.player
+
+    def start_search_game(self):
+        super().start_search_game()
+        self.root = self.shared_node(self.root)
+
+    def end_search_game(self):
+        self.table.end_search_game()
 
     def move_next_root(self):
         action_space = self.sim_world.get_action_space()
-        dist = [self.edge_visits.get((self.root.state, action), 0) / self.node_visits[self.root.state] for action in self.sim_world.get_action_space()]
+        edge_visits = dict(zip(self.root.actions, self.root.edge_visits))
+        dist = [edge_visits.get(action, 0) / self.root.visits for action in action_space]
         best_action = action_space[dist.index(max(dist))]
         print(np.array(self.root.state)[None], np.array(dist)[None])
-        print(self.node_visits[self.root.state])
-        self.root = next(filter(lambda child : child.prev_action == best_action, self.root.children))
+        print(self.root.visits)
+        self.set_root(self.root.children[self.root.actions.index(best_action)])
         return self.root, dist
 
     def get_root(self):
         return self.root
 
-    def manual_set_root(self, state):
-        try:
-            self.root = self.nodes[state]
-        except KeyError:
-            self.root = TreeNode(state, bool(state[len(state) - 1]), None, None)
-
-    def exploration_bonus(self, state, to_state, action):
-        if self.node_visits.get(to_state, 0) == 0 or self.node_visits.get(to_state, 0) == 1:
-            return math.inf
-        c = 1
-        return c * sqrt(log(self.node_visits.get(to_state, 0)) / (1 + self.edge_visits.get((state, action), 0)))
-
-
-    def player_action_value(self, state, to_state, action):
-        return self.tree_policy.get((state, action), 0) + self.exploration_bonus(state, to_state, action)
-
-
-    def non_player_action_value(self, state, to_state, action):
-        return self.tree_policy.get((state, action), 0) - self.exploration_bonus(state, to_state, action)
+    def get_root_visits(self):
+        return self.root.visits, dict(zip(self.root.actions, self.root.edge_visits))
 
+    def manual_set_root(self, state):
+        player = bool(state[len(state) - 1])
+        self.sim_world.set_current_state(state, player)
+        node = self.table.get(self.sim_world.get_state_key())
+        if node is None:
+            node = TreeNode(state, player, None, None, key=self.sim_world.get_state_key())
+            self.table.put(node)
+        if node is not self.root:
+            self.set_root(node)
+
+    def set_root(self, node: TreeNode):
+        # Keep the statistics below the new root and free everything else
+        self.root = self.shared_node(node)
+        self.reclaimed = self.table.prune(self.root)
+        print("Reclaimed nodes, edges:", self.reclaimed)
+        if self.table.capacity:
+            print("Evicted nodes:", self.table.evicted_count)
 
     def tree_search(self, root: TreeNode):
-        # Stop when finding leaf node
-        if len(root.children) == 0:
-            return root
-        
-        # Min-max search
-        best_node = root.children[0]
-        #for child in root.children:
-        #    print(self.tree_policy.get((root.state, child.prev_action), 0))
-        if root.player:
-            best_node = max(root.children, key=lambda child : self.player_action_value(root.state, child.state, child.prev_action))
-        else:
-            best_node = min(root.children, key=lambda child : self.non_player_action_value(root.state, child.state, child.prev_action))
-        
-        # Recurisvly do tree search
-        return self.tree_search(best_node)
-            
+        node = root
+        path = [root]
+        edges = []
+        # Descend until finding a leaf node
+        while len(node.children) > 0:
+            children = node.children
+            values = np.array(node.edge_values, dtype=np.float64)
+            edge_visits = np.array(node.edge_visits, dtype=np.float64)
+            child_visits = np.array([child.visits for child in children], dtype=np.float64)
+            bonus = exploration_bonus(child_visits, edge_visits)
+
+            # Min-max search
+            if node.player:
+                edge = int(np.argmax(values + bonus))
+            else:
+                edge = int(np.argmin(values - bonus))
+            self.sim_world.perform_action(node.actions[edge])
+            node.children[edge] = self.shared_node(node.children[edge])
+            node = node.children[edge]
+            path.append(node)
+            edges.append(edge)
+        return path, edges
+
+    def shared_node(self, node: TreeNode):
+        if not node.evicted:
+            self.table.touch(node)
+            return node
+        # Use the node the table now holds for this state, or bring the evicted node back
+        shared = self.table.get(node.key)
+        if shared is None:
+            self.table.put(node)
+            return node
+        return shared
 
     def node_expansion(self, node: TreeNode):
-        self.sim_world.set_current_state(node.state, node.player)
-        legal_actions = self.sim_world.get_legal_actions()
+        legal_actions = self.sim_world.get_pruned_actions()
         for action in legal_actions:
-            self.sim_world.set_current_state(node.state, node.player)
-            self.sim_world.perform_action(action)
-            state = self.sim_world.get_current_encoded_state()
-            player = self.sim_world.get_current_player()
-            new_node = TreeNode(state, player, node, action)
-            if state not in self.nodes.keys():
-                self.nodes[state] = new_node
-            node.add_child(new_node)
-
-
-    def leaf_evaluation(self, leaf_node: TreeNode, actor, epsilon = 0):
-        node = leaf_node
-        self.sim_world.set_current_state(node.state, node.player)
-
-        # Rollout to final state
-        while not self.sim_world.is_final_state():
-            # Get best action or random action depending on epsilon
-            action = actor.get_action(node.state, epsilon)
-
-            # Perform the action and create rollout node
             self.sim_world.perform_action(action)
-            new_node = TreeNode(self.sim_world.get_current_encoded_state(), self.sim_world.get_current_player(), node, action, rollout=True)
-            node.add_child(new_node)
-            node = new_node
-        return node
-
-
-    def backpropagation(self, final_node: TreeNode):
-        self.sim_world.set_current_state(final_node.state, final_node.player)
-        reward = self.sim_world.get_reward()
-        node = final_node
-        child_node = None
-        while node:
-            # Backprop updates
-            self.node_visits[node.state] = self.node_visits.get(node.state, 0) + 1
-            if child_node:
-                prev_eval = self.tree_policy.get((node.state, child_node.prev_action), 0) * (self.node_visits.get(node.state, 0) - 1)
-                self.edge_visits[node.state, child_node.prev_action] = self.edge_visits.get((node.state, child_node.prev_action), 0) + 1
-                self.tree_policy[node.state, child_node.prev_action] = (prev_eval + reward) / self.node_visits.get(node.state, 0) # (reward - self.tree_policy.get((node.state, child_node.prev_action), 0)) / (self.node_visits.get(node.state, 0) + 1)
-            
-            # Delete this node if it is a rollout node
-            if node.rollout:
-                node.parent.children.remove(node)
-            
-            # Update node pointers for next iteration
-            child_node = node
-            node = node.parent
+            key = self.sim_world.get_state_key()
+            child = self.table.get(key)
+            if child is None:
+                child = TreeNode(self.sim_world.get_current_encoded_state(), self.sim_world.get_current_player(), node, action, key=key)
+                self.table.put(child)
+            self.sim_world.undo_action()
+            node.add_child(child, action)
+
+    def first_step(self, path, edges, action):
+        leaf_node = path[-1]
+        if action in leaf_node.actions:
+            edge = leaf_node.actions.index(action)
+            return path + [leaf_node.children[edge]], edges + [edge]
+        return path, edges
+
+    def add_visits(self, path, edges, count):
+        for i, node in enumerate(path):
+            node.visits += count
+            if i < len(edges):
+                node.edge_visits[edges[i]] += count
+
+
+    def backpropagation(self, path, edges, reward):
+        for i in range(len(path) - 1, -1, -1):
+            node = path[i]
+            node.visits += 1
+            if i < len(edges):
+                edge = edges[i]
+                node.edge_values[edge] = (node.edge_values[edge] * (node.visits - 1) + reward) / node.visits
+                node.edge_visits[edge] += 1
@@ -0,0 +1,502 @@
+import copy
+import multiprocessing
+import random
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from array_mcts import ArrayMonteCarloTreeSearch
+from learners.learner import Learner
+from mcts import MCTS_Parameters, MonteCarloTreeSearch, exploration_bonus
+from simworlds.simworld import SimWorld
+from tree_node import TreeNode
+
+LOCK_STRIPES = 64
+
+# Barrier shared by all workers of a SearchPool and the process owning it
+worker_barrier = None
+
+
+def init_pool_worker(barrier, initializer, initargs):
+    global worker_barrier
+    worker_barrier = barrier
+    initializer(*initargs)
+    barrier.wait()
+
+
+def run_on_every_worker(function, args):
+    function(*args)
+    worker_barrier.wait()
+
+
+def update_worker_weights(weights):
+    global worker_mcts
+    worker_actor.set_learner_weights(weights)
+    # Statistics gathered with the old weights would steer the next searches
+    worker_mcts = None
+
+
+class SearchPool:
+    """
+    A spawn pool of search worker processes that is kept alive between searches.
+
+    The workers hold a copy of the actor's learner. They are only started again for another
+    learner, when the same learner has been trained or loaded since, its new weights are
+    sent to the running workers instead.
+    """
+
+    def __init__(self, workers, initializer):
+        self.workers = workers
+        self.initializer = initializer
+        self.context = multiprocessing.get_context("spawn")
+        self.barrier = self.context.Barrier(workers + 1)
+        self.pool = None
+        self.learner = None
+        self.learner_version = None
+
+    def start(self, actor, initargs):
+        # Returns whether the workers now search with another learner or other weights than before
+        if self.pool and self.learner is actor.learner:
+            if self.learner_version == actor.learner_version:
+                return False
+            self.run_on_every_worker(update_worker_weights, actor.learner.get_weights())
+            self.learner_version = actor.learner_version
+            return True
+        self.close()
+        self.pool = self.context.Pool(self.workers, initializer=init_pool_worker, initargs=(self.barrier, self.initializer, initargs))
+        # Wait until every worker has started and loaded the learner
+        self.barrier.wait()
+        self.learner = actor.learner
+        self.learner_version = actor.learner_version
+        return True
+
+    def run_on_every_worker(self, function, *args):
+        # Each worker waits at the barrier after its task, so every worker takes exactly one of the tasks
+        result = self.pool.starmap_async(run_on_every_worker, [(function, args)] * self.workers, chunksize=1)
+        self.barrier.wait()
+        result.get()
+
+    def starmap(self, function, tasks):
+        return self.pool.starmap(function, tasks)
+
+    def close(self):
+        if self.pool:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+            self.learner = None
+
+
+# State of a search worker process, set up once by init_search_worker
+worker_sim_world = None
+worker_actor = None
+worker_params = None
+worker_mcts = None
+
+
+def init_search_worker(sim_world: SimWorld, learner: Learner, params: MCTS_Parameters):
+    global worker_sim_world, worker_actor, worker_params, worker_mcts
+    # Imported here since actor imports this module through search
+    from actor import Actor
+    random.seed()
+    np.random.seed()
+    worker_sim_world = sim_world
+    worker_actor = Actor(sim_world, learner)
+    worker_params = copy.copy(params)
+    worker_params.workers = 1
+    worker_mcts = None
+
+
+def run_search_worker(state, player, search_games, epsilon, time_limit):
+    global worker_mcts
+    worker_sim_world.set_current_state(state, player)
+    if worker_mcts is None:
+        if worker_params.tree == "array":
+            worker_mcts = ArrayMonteCarloTreeSearch(worker_sim_world, worker_params)
+        else:
+            worker_mcts = MonteCarloTreeSearch(worker_sim_world, worker_params)
+    else:
+        worker_mcts.manual_set_root(state)
+
+    # Only report the visits added by this call, the worker's tree may hold visits from earlier calls
+    visits_before, edge_visits_before = worker_mcts.get_root_visits()
+    count, elapsed = worker_mcts.run_search(worker_actor, epsilon, search_games, time_limit)
+    visits, edge_visits = worker_mcts.get_root_visits()
+    edge_visits = {action: visit_count - edge_visits_before.get(action, 0) for action, visit_count in edge_visits.items()}
+    return visits - visits_before, edge_visits, count
+
+
+class RootParallelMonteCarloTreeSearch:
+    """
+    Root parallel search: every worker process searches its own tree from the same root,
+    and the root edge visits of all workers are summed into one distribution.
+    """
+
+    def __init__(self, sim_world: SimWorld, params: MCTS_Parameters = None):
+        self.sim_world = sim_world
+        self.params = params if params else MCTS_Parameters()
+        self.root = TreeNode(self.sim_world.get_current_encoded_state(), self.sim_world.get_current_player(), None, None)
+        self.root_visits = 0
+        self.edge_visits = {}
+        self.pool = SearchPool(self.params.workers, init_search_worker)
+
+    def run_search(self, actor, epsilon, search_games, time_limit=0):
+        self.pool.start(actor, (self.sim_world, actor.learner, self.params))
+        t = time.time()
+        # With a time limit every worker searches until the deadline, otherwise the search games are split between them
+        games = [search_games // self.params.workers + int(i < search_games % self.params.workers) for i in range(self.params.workers)]
+        tasks = [(self.root.state, self.root.player, count, epsilon, time_limit) for count in games if count or time_limit]
+        total = 0
+        for visits, edge_visits, count in self.pool.starmap(run_search_worker, tasks):
+            self.root_visits += visits
+            total += count
+            for action, visit_count in edge_visits.items():
+                self.edge_visits[action] = self.edge_visits.get(action, 0) + visit_count
+        elapsed = time.time() - t
+        print(f"Search games: {total} in {elapsed:.3f}s")
+        return total, elapsed
+
+    def run_search_game(self, actor, epsilon):
+        self.run_search(actor, epsilon, 1)
+
+    def move_next_root(self):
+        action_space = self.sim_world.get_action_space()
+        dist = [self.edge_visits.get(action, 0) / self.root_visits for action in action_space]
+        best_action = action_space[dist.index(max(dist))]
+        print(np.array(self.root.state)[None], np.array(dist)[None])
+        print(self.root_visits)
+        self.sim_world.set_current_state(self.root.state, self.root.player)
+        self.sim_world.perform_action(best_action)
+        self.set_root(TreeNode(self.sim_world.get_current_encoded_state(), self.sim_world.get_current_player(), None, best_action))
+        return self.root, dist
+
+    def get_root(self):
+        return self.root
+
+    def get_root_visits(self):
+        return self.root_visits, dict(self.edge_visits)
+
+    def manual_set_root(self, state):
+        if state != self.root.state:
+            self.set_root(TreeNode(state, bool(state[len(state) - 1]), None, None))
+
+    def set_root(self, node: TreeNode):
+        self.root = node
+        self.root_visits = 0
+        self.edge_visits = {}
+
+    def close(self):
+        self.pool.close()
+
+
+# Indexes into SharedTree.counters
+COUNTERS = NODE_COUNT, EDGE_TOTAL, GAMES_STARTED = range(3)
+
+
+class SharedTree:
+    """
+    The node and edge arrays of a tree parallel search, each backed by a shared memory
+    block so that worker processes search the same tree. The tree has a fixed capacity,
+    since shared memory blocks can't grow. The process creating the blocks unlinks them
+    again in close(), other processes attach to them by name.
+    """
+
+    NODE_ARRAYS = (("node_visits", np.int64), ("node_player", bool), ("first_edge", np.int64), ("edge_count", np.int64))
+    EDGE_ARRAYS = (("edge_child", np.int64), ("edge_action", np.int64), ("edge_visits", np.int64), ("edge_values", np.float64), ("virtual_loss", np.int64))
+
+    def __init__(self, node_capacity, edge_capacity, names=None):
+        self.node_capacity = node_capacity
+        self.edge_capacity = edge_capacity
+        self.owner = names is None
+        self.blocks = {}
+        arrays = [(name, dtype, node_capacity) for name, dtype in self.NODE_ARRAYS]
+        arrays += [(name, dtype, edge_capacity) for name, dtype in self.EDGE_ARRAYS]
+        arrays.append(("counters", np.int64, len(COUNTERS)))
+        for name, dtype, length in arrays:
+            if self.owner:
+                block = shared_memory.SharedMemory(create=True, size=length * np.dtype(dtype).itemsize)
+            else:
+                block = shared_memory.SharedMemory(name=names[name])
+            self.blocks[name] = block
+            setattr(self, name, np.ndarray(length, dtype=dtype, buffer=block.buf))
+
+    def names(self):
+        return {name: block.name for name, block in self.blocks.items()}
+
+    def close(self):
+        # The array views must be gone before their blocks can be closed
+        for name, block in self.blocks.items():
+            delattr(self, name)
+            block.close()
+            if self.owner:
+                block.unlink()
+        self.blocks = {}
+
+
+# State of a tree parallel worker process, set up once by init_tree_worker
+worker_tree_search = None
+
+
+def init_tree_worker(sim_world: SimWorld, learner: Learner, params: MCTS_Parameters, names, node_capacity, edge_capacity, structure_lock, stat_locks):
+    global worker_actor, worker_tree_search
+    from actor import Actor
+    random.seed()
+    np.random.seed()
+    worker_actor = Actor(sim_world, learner)
+    worker_tree_search = SharedTreeSearch(sim_world, params, SharedTree(node_capacity, edge_capacity, names), structure_lock, stat_locks)
+
+
+def run_tree_worker(root, state, player, search_games, epsilon, deadline):
+    return worker_tree_search.run_shared_search(worker_actor, root, state, player, search_games, epsilon, deadline)
+
+
+class SharedTreeSearch(ArrayMonteCarloTreeSearch):
+    """
+    The search run by each tree parallel worker process on the shared tree.
+
+    Every edge a worker selects gets a virtual loss until that worker has backpropagated,
+    so other workers are steered to different branches. Node statistics are guarded by a
+    striped set of locks and allocating nodes and edges by a structure lock. Nodes are
+    not shared between transpositions, since the state keys only live in one process, so
+    every expansion allocates a new child node per edge.
+    """
+
+    def __init__(self, sim_world: SimWorld, params: MCTS_Parameters, tree: SharedTree, structure_lock, stat_locks):
+        self.sim_world = sim_world
+        self.params = params
+        self.action_space = self.sim_world.get_action_space()
+        self.tree = tree
+        for name, dtype in SharedTree.NODE_ARRAYS + SharedTree.EDGE_ARRAYS:
+            setattr(self, name, getattr(tree, name))
+        self.counters = tree.counters
+        self.structure_lock = structure_lock
+        self.stat_locks = stat_locks
+        self.root = 0
+        self.root_encoded = None
+        self.root_player = None
+        self.loss_edges = []
+
+    def root_state(self):
+        return self.root_encoded, self.root_player
+
+    def run_shared_search(self, actor, root, state, player, search_games, epsilon, deadline):
+        # Claim search games from the shared counter until search_games are started or the deadline has passed, the
+        # deadline only ends a search once some worker has started a game
+        self.root = root
+        self.root_encoded = state
+        self.root_player = player
+        count = 0
+        while True:
+            with self.structure_lock:
+                started = self.counters[GAMES_STARTED]
+                if search_games and started >= search_games or deadline and started and time.time() >= deadline:
+                    return count
+                self.counters[GAMES_STARTED] += 1
+            self.run_search_game(actor, epsilon)
+            count += 1
+
+    def stat_lock(self, node):
+        return self.stat_locks[node % LOCK_STRIPES]
+
+    def select_edge(self, node):
+        edges = slice(self.first_edge[node], self.first_edge[node] + self.edge_count[node])
+        virtual_loss = self.virtual_loss[edges]
+        visits = self.edge_visits[edges]
+        # Count in-flight visits as losses for the player choosing at this node
+        loss = -1 if self.node_player[node] else 1
+        values = (self.edge_values[edges] * visits + loss * virtual_loss) / np.maximum(visits + virtual_loss, 1)
+        child_visits = self.node_visits[self.edge_child[edges]] + virtual_loss
+        bonus = exploration_bonus(child_visits, visits + virtual_loss)
+        if self.node_player[node]:
+            return edges.start + int(np.argmax(values + bonus))
+        return edges.start + int(np.argmin(values - bonus))
+
+    def tree_search(self, root):
+        path = [root]
+        edges = []
+        node = root
+        while True:
+            with self.stat_lock(node):
+                if not self.edge_count[node]:
+                    break
+                edge = self.select_edge(node)
+                self.virtual_loss[edge] += self.params.virtual_loss
+                child = int(self.edge_child[edge])
+                action_index = self.edge_action[edge]
+            self.sim_world.perform_action(self.action_space[action_index])
+            node = child
+            path.append(node)
+            edges.append(edge)
+        self.loss_edges = list(edges)
+        return path, edges
+
+    def node_expansion(self, node):
+        if self.edge_count[node]:
+            return
+        legal_actions = self.sim_world.get_pruned_actions()
+        players = []
+        for action in legal_actions:
+            self.sim_world.perform_action(action)
+            players.append(self.sim_world.get_current_player())
+            self.sim_world.undo_action()
+        count = len(legal_actions)
+        with self.structure_lock:
+            # Another worker may have expanded this leaf meanwhile. Once the tree is full it stops growing,
+            # the leaf is still played out and backpropagated
+            if self.edge_count[node] or self.counters[EDGE_TOTAL] + count > self.tree.edge_capacity or self.counters[NODE_COUNT] + count > self.tree.node_capacity:
+                return
+            first = int(self.counters[EDGE_TOTAL])
+            first_child = int(self.counters[NODE_COUNT])
+            edges = slice(first, first + count)
+            children = slice(first_child, first_child + count)
+            self.node_visits[children] = 0
+            self.node_player[children] = players
+            self.edge_count[children] = 0
+            self.edge_child[edges] = np.arange(first_child, first_child + count)
+            self.edge_action[edges] = [self.sim_world.get_action_index(action) for action in legal_actions]
+            self.edge_visits[edges] = 0
+            self.edge_values[edges] = 0
+            self.virtual_loss[edges] = 0
+            self.counters[EDGE_TOTAL] += count
+            self.counters[NODE_COUNT] += count
+            # Other workers only descend into a node once its edge count is set
+            with self.stat_lock(node):
+                self.first_edge[node] = first
+                self.edge_count[node] = count
+
+    def backpropagation(self, path, edges, reward):
+        for i in range(len(path) - 1, -1, -1):
+            node = path[i]
+            with self.stat_lock(node):
+                self.node_visits[node] += 1
+                if i < len(edges):
+                    edge = edges[i]
+                    visits = self.node_visits[node]
+                    self.edge_values[edge] = (self.edge_values[edge] * (visits - 1) + reward) / visits
+                    self.edge_visits[edge] += 1
+                if i < len(self.loss_edges):
+                    self.virtual_loss[self.loss_edges[i]] -= self.params.virtual_loss
+
+
+class TreeParallelMonteCarloTreeSearch:
+    """
+    Tree parallel search: worker processes descend one tree in shared memory at the same
+    time, see SharedTreeSearch.
+
+    The tree holds the edges of params.capacity expanded nodes. After a move the subtree of
+    the new root is kept in place, and the tree is only cleared once over half of it is
+    used, since the shared arrays can't be compacted while workers hold on to them. The
+    shared memory is only allocated by the first search, and released again by close().
+    """
+
+    def __init__(self, sim_world: SimWorld, params: MCTS_Parameters = None):
+        self.sim_world = sim_world
+        self.params = params if params else MCTS_Parameters()
+        self.action_space = self.sim_world.get_action_space()
+        self.tree = None
+        self.pool = SearchPool(self.params.workers, init_tree_worker)
+        self.structure_lock = self.pool.context.Lock()
+        self.stat_locks = [self.pool.context.Lock() for _ in range(LOCK_STRIPES)]
+        self.reclaimed = (0, 0)
+        self.reset_tree(self.sim_world.get_current_encoded_state(), self.sim_world.get_current_player())
+
+    def open_tree(self):
+        edge_capacity = self.params.capacity * len(self.action_space)
+        self.tree = SharedTree(edge_capacity + 1, edge_capacity)
+        self.reset_tree(self.root_encoded, self.root_player)
+
+    def reset_tree(self, state, player):
+        self.root = 0
+        self.root_encoded = state
+        self.root_player = player
+        if self.tree is None:
+            self.reclaimed = (0, 0)
+            return
+        self.reclaimed = (int(self.tree.counters[NODE_COUNT]), int(self.tree.counters[EDGE_TOTAL]))
+        self.tree.counters[NODE_COUNT] = 1
+        self.tree.counters[EDGE_TOTAL] = 0
+        self.tree.node_visits[0] = 0
+        self.tree.node_player[0] = player
+        self.tree.edge_count[0] = 0
+
+    def start_pool(self, actor):
+        worker_params = copy.copy(self.params)
+        worker_params.batch_size = 1
+        initargs = (self.sim_world, actor.learner, worker_params, self.tree.names(), self.tree.node_capacity, self.tree.edge_capacity, self.structure_lock, self.stat_locks)
+        # Statistics gathered with another learner or older weights would steer the next searches
+        if self.pool.start(actor, initargs):
+            self.reset_tree(self.root_encoded, self.root_player)
+
+    def run_search(self, actor, epsilon, search_games, time_limit=0):
+        if not search_games and not time_limit:
+            return 0, 0
+        if self.tree is None:
+            self.open_tree()
+        self.start_pool(actor)
+        # Starting or updating the workers doesn't count towards the time limit
+        t = time.time()
+        self.tree.counters[GAMES_STARTED] = 0
+        deadline = t + time_limit if time_limit else 0
+        tasks = [(self.root, self.root_encoded, self.root_player, search_games, epsilon, deadline)] * self.params.workers
+        count = sum(self.pool.starmap(run_tree_worker, tasks))
+        elapsed = time.time() - t
+        print(f"Search games: {count} in {elapsed:.3f}s")
+        return count, elapsed
+
+    def run_search_game(self, actor, epsilon):
+        self.run_search(actor, epsilon, 1)
+
+    def root_edges(self):
+        first = self.tree.first_edge[self.root]
+        return slice(first, first + self.tree.edge_count[self.root])
+
+    def move_next_root(self):
+        self.sim_world.set_current_state(self.root_encoded, self.root_player)
+        visits = int(self.tree.node_visits[self.root]) if self.tree is not None else 0
+        searched = visits and self.tree.edge_visits[self.root_edges()].any()
+        dist = np.zeros(len(self.action_space))
+        if searched:
+            edges = self.root_edges()
+            dist[self.tree.edge_action[edges]] = self.tree.edge_visits[edges] / visits
+        else:
+            # Nothing was searched from this root, so every move the search would expand is as good as the others
+            dist[[self.sim_world.get_action_index(action) for action in self.sim_world.get_pruned_actions()]] = 1
+            dist /= dist.sum()
+        dist = dist.tolist()
+        best_index = dist.index(max(dist))
+        print(np.array(self.root_encoded)[None], np.array(dist)[None])
+        print(visits)
+        self.sim_world.perform_action(self.action_space[best_index])
+        state, player = self.sim_world.get_current_encoded_state(), self.sim_world.get_current_player()
+        if not searched or self.tree.counters[NODE_COUNT] > self.tree.node_capacity // 2:
+            self.reset_tree(state, player)
+        else:
+            edges = self.root_edges()
+            self.root = int(self.tree.edge_child[edges.start + int(np.flatnonzero(self.tree.edge_action[edges] == best_index)[0])])
+            self.root_encoded = state
+            self.root_player = player
+            self.reclaimed = (0, 0)
+        print("Reclaimed nodes, edges:", self.reclaimed)
+        return TreeNode(state, player, None, self.action_space[best_index]), dist
+
+    def get_root(self):
+        return TreeNode(self.root_encoded, self.root_player, None, None)
+
+    def get_root_visits(self):
+        if self.tree is None:
+            return 0, {}
+        edges = self.root_edges()
+        actions = [self.action_space[index] for index in self.tree.edge_action[edges]]
+        return int(self.tree.node_visits[self.root]), dict(zip(actions, self.tree.edge_visits[edges].tolist()))
+
+    def manual_set_root(self, state):
+        if state != self.root_encoded:
+            self.reset_tree(state, bool(state[len(state) - 1]))
+            print("Reclaimed nodes, edges:", self.reclaimed)
+
+    def close(self):
+        # Workers are attached to the tree, so they go first
+        self.pool.close()
+        if self.tree is not None:
+            self.tree.close()
+            self.tree = None
@@ -0,0 +1,122 @@
+import json
+import os
+import numpy as np
+
+
+class ReplayBufferParams:
+
+    def __init__(self, capacity=100000, sampling="uniform"):
+        self.capacity = capacity
+        self.sampling = sampling
+
+
+class ReplayBuffer:
+    """
+    Fixed capacity replay memory of (state, dist) samples in preallocated NumPy arrays.
+
+    Samples are written round robin, so once the buffer is full every new sample overwrites
+    the oldest one. Minibatches are drawn uniformly, or with "recency" sampling weighted
+    linearly towards the newest samples.
+
+    On disk the buffer is a directory of append-only segments, pairs of states and dists
+    .npy files listed in index.json. Every save appends one segment with the samples added
+    since the previous save, and loading memory maps the segments newest first and only
+    reads as many samples as fit in the buffer.
+    """
+
+    def __init__(self, state_size, dist_size, params: ReplayBufferParams = None):
+        self.params = params if params else ReplayBufferParams()
+        self.capacity = self.params.capacity
+        self.states = np.zeros((self.capacity, state_size), dtype=np.float32)
+        self.dists = np.zeros((self.capacity, dist_size), dtype=np.float32)
+        self.size = 0
+        self.next = 0
+        self.added = 0
+        self.saved = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, dist):
+        self.states[self.next] = state
+        self.dists[self.next] = dist
+        self.next = (self.next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.added += 1
+
+    def extend(self, samples):
+        for state, dist in samples:
+            self.add(state, dist)
+
+    def get_states(self):
+        # Views of the filled part of the arrays, in slot order rather than insertion order once the buffer has wrapped
+        return self.states[:self.size]
+
+    def get_dists(self):
+        return self.dists[:self.size]
+
+    def get_recent(self, count):
+        # The newest count samples in insertion order, as copies
+        slots = self.recent_slots(min(count, self.size))
+        return self.states[slots], self.dists[slots]
+
+    def recent_slots(self, count):
+        return (self.next - count + np.arange(count)) % self.capacity
+
+    def sample(self, batch_size):
+        if batch_size >= self.size:
+            return self.get_states(), self.get_dists()
+        if self.params.sampling == "recency":
+            # Age 0 is the newest sample, weights fall linearly to 1 for the oldest
+            ages = (self.next - 1 - np.arange(self.size)) % self.size
+            weights = (self.size - ages).astype(np.float64)
+            indexes = np.random.choice(self.size, batch_size, replace=False, p=weights / weights.sum())
+        else:
+            indexes = np.random.choice(self.size, batch_size, replace=False)
+        return self.states[indexes], self.dists[indexes]
+
+    def save(self, dirpath):
+        os.makedirs(dirpath, exist_ok=True)
+        index = self.read_index(dirpath)
+        # Samples overwritten since the last save are lost, only the ones still in the buffer can be appended
+        count = min(self.added - self.saved, self.size)
+        if count:
+            slots = self.recent_slots(count)
+            segment = len(index["segments"])
+            np.save(f"{dirpath}{os.sep}states_{segment}.npy", self.states[slots])
+            np.save(f"{dirpath}{os.sep}dists_{segment}.npy", self.dists[slots])
+            index["segments"].append({"id": segment, "count": int(count)})
+        self.saved = self.added
+        index["added"] = self.added
+        # Replace the index last, so a crash mid save leaves the previous checkpoint readable
+        with open(f"{dirpath}{os.sep}index.json.tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(f"{dirpath}{os.sep}index.json.tmp", f"{dirpath}{os.sep}index.json")
+
+    def load(self, dirpath):
+        index = self.read_index(dirpath)
+        parts = []
+        remaining = self.capacity
+        for segment in reversed(index["segments"]):
+            if not remaining:
+                break
+            states = np.load(f"{dirpath}{os.sep}states_{segment['id']}.npy", mmap_mode="r")
+            dists = np.load(f"{dirpath}{os.sep}dists_{segment['id']}.npy", mmap_mode="r")
+            take = min(remaining, len(states))
+            parts.append((states[len(states) - take:], dists[len(dists) - take:]))
+            remaining -= take
+        self.size = 0
+        for states, dists in reversed(parts):
+            self.states[self.size:self.size + len(states)] = states
+            self.dists[self.size:self.size + len(dists)] = dists
+            self.size += len(states)
+        self.next = self.size % self.capacity
+        self.added = index["added"]
+        self.saved = self.added
+
+    @staticmethod
+    def read_index(dirpath):
+        if not os.path.exists(f"{dirpath}{os.sep}index.json"):
+            return {"segments": [], "added": 0}
+        with open(f"{dirpath}{os.sep}index.json") as f:
+            return json.load(f)
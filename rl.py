@@ -1,25 +1,37 @@
 
+import multiprocessing
 import os
 import pickle
+import numpy as np
 from actor import Actor
 from learners.learner import Learner
-from mcts import MonteCarloTreeSearch
+from mcts import MCTS_Parameters, MonteCarloTreeSearch
+from replay_buffer import ReplayBuffer, ReplayBufferParams
+from search import new_mcts
+from self_play import run_self_play_worker
 from simworlds.simworld import SimWorld
 from visualizer import Visualizer
 
 class RLSystem:
 
-    def __init__(self, sim_world: SimWorld, learner: Learner, epsilon=0.15, save_interval = 10, visualize=False, frame_delay=0.25):
+    def __init__(self, sim_world: SimWorld, learner: Learner, epsilon=0.15, save_interval = 10, visualize=False, frame_delay=0.25, mcts_params: MCTS_Parameters = None, replay_params: ReplayBufferParams = None, augment=False, self_play_workers=1, weight_refresh=1, batch_games=0, cache_size=0):
         self.sim_world = sim_world
+        self.mcts_params = mcts_params
         self.save_interval = save_interval
-        self.actor = Actor(self.sim_world, learner)
+        self.cache_size = cache_size
+        self.actor = Actor(self.sim_world, learner, cache_size=cache_size)
         self.actor.init_learner()
         self.opponent = None
         self.opponent_is_player = False
         self.epsilon = epsilon
+        self.augment = augment
+        self.self_play_workers = self_play_workers
+        self.weight_refresh = weight_refresh
+        self.batch_games = batch_games
         self.visualizer = Visualizer(self.sim_world, frame_delay=frame_delay)
         self.visualizer.set_visualize(visualize)
-        self.replay_buffer = []
+        self.replay_buffer = ReplayBuffer(self.sim_world.get_encoding_shape()[0], len(self.sim_world.get_action_space()), replay_params)
+        self.mcts = None
         self.episode_buffer = []
         self.save_interval = 10
 
@@ -27,17 +39,101 @@ class RLSystem:
         self.epsilon_decay = self.epsilon
         if episodes > 1:
             self.epsilon_decay = self.epsilon / (episodes - 1)
-        for episode_num in range(episodes):
-            self.reset_episode_data()
-            self.sim_world.produce_init_state()
-            mcts = MonteCarloTreeSearch(self.sim_world)
-            self.visualizer.init_visualize_episode(title=f"Training Game {episode_num} of {episodes}")
-            while not self.sim_world.is_final_state():
-                self.run_episode_move(mcts, search_games)
-            self.visualizer.visualize_final_state()
-            self.update_buffers(1 if self.sim_world.get_reward() == 1 else 0)
+        if self.batch_games:
+            self.run_batch_episodes(episodes)
+            return
+        if self.self_play_workers > 1:
+            self.run_parallel_episodes(episodes, search_games)
+            return
+        try:
+            for episode_num in range(episodes):
+                self.replay_buffer.extend(self.play_episode(search_games, title=f"Training Game {episode_num} of {episodes}"))
+                self.actor.train_learner(self.replay_buffer)
+                self.epsilon -= self.epsilon_decay
+        finally:
+            self.close_search()
+        for name, stats in self.actor.get_cache_stats().items():
+            print(f"Cached {name}: {stats}")
+
+    def run_parallel_episodes(self, episodes, search_games):
+        # Worker processes play the episodes while this process trains on their samples and publishes new weights
+        # every weight_refresh episodes. Spawned workers start without this process' TensorFlow state
+        context = multiprocessing.get_context("spawn")
+        sample_queue = context.Queue()
+        weight_queues = [context.Queue() for _ in range(self.self_play_workers)]
+        stop_event = context.Event()
+        learner = self.actor.learner
+        workers = [context.Process(target=run_self_play_worker, args=(self.sim_world, type(learner), learner.params, self.mcts_params, search_games, self.augment, self.cache_size, sample_queue, weight_queue, stop_event)) for weight_queue in weight_queues]
+        for worker in workers:
+            worker.start()
+        self.publish_weights(weight_queues)
+        try:
+            for episode_num in range(episodes):
+                self.replay_buffer.extend(sample_queue.get())
+                self.actor.train_learner(self.replay_buffer)
+                self.epsilon -= self.epsilon_decay
+                if (episode_num + 1) % self.weight_refresh == 0:
+                    self.publish_weights(weight_queues)
+        finally:
+            stop_event.set()
+            for worker in workers:
+                worker.terminate()
+                worker.join()
+
+    def run_batch_episodes(self, episodes):
+        # Play batch_games episodes at a time in lockstep, training after each batch
+        played = 0
+        while played < episodes:
+            games = min(self.batch_games, episodes - played)
+            self.replay_buffer.extend(self.play_batch_episodes(games))
             self.actor.train_learner(self.replay_buffer)
-            self.epsilon -= self.epsilon_decay
+            self.epsilon -= self.epsilon_decay * games
+            played += games
+            print(f"Batch episodes: {played} of {episodes}")
+
+    def play_batch_episodes(self, games):
+        # Learner policy self-play without search, with the learner queried once per ply for all games. The targets are
+        # one-hot dists of the moves played, kept for the winner's positions like in update_buffers
+        batch = self.sim_world.get_batch(games)
+        batch.produce_init_state(np.arange(games) % 2 == 0)
+        history = []
+        while not batch.all_final():
+            running = np.flatnonzero(~batch.is_final_states())
+            states = batch.get_encoded_states()[running]
+            actions = self.actor.choose_batch_actions(states, batch.get_legal_masks()[running], self.epsilon)
+            history.append((running, states, actions))
+            batch.perform_actions(actions, running)
+        winners = batch.get_rewards() == 1
+        action_count = len(batch.get_action_space())
+        samples = []
+        for running, states, actions in history:
+            for game, state, action in zip(running, states, actions):
+                if state[-1] == winners[game]:
+                    dist = [0] * action_count
+                    dist[action] = 1
+                    samples.append((tuple(state.tolist()), dist))
+        return self.augmented(samples)
+
+    def publish_weights(self, weight_queues):
+        weights = self.actor.learner.get_weights()
+        for weight_queue in weight_queues:
+            weight_queue.put((weights, self.epsilon))
+
+    def play_episode(self, search_games, title="Training Game"):
+        # Play one episode and return the samples it adds to the replay buffer
+        self.reset_episode_data()
+        self.sim_world.produce_init_state()
+        # One search is kept for all episodes, so parallel searches keep their workers. The last episode ended on a
+        # final state, which nothing searched before can reach, so moving the root to the start leaves a fresh tree
+        if self.mcts is None:
+            self.mcts = new_mcts(self.sim_world, self.mcts_params)
+        else:
+            self.mcts.manual_set_root(self.sim_world.get_current_encoded_state())
+        self.visualizer.init_visualize_episode(title=title)
+        while not self.sim_world.is_final_state():
+            self.run_episode_move(self.mcts, search_games)
+        self.visualizer.visualize_final_state()
+        return self.episode_samples(1 if self.sim_world.get_reward() == 1 else 0)
 
     def run_episode_move(self, mcts: MonteCarloTreeSearch, search_games):
         self.visualizer.visualize_state()
@@ -48,17 +144,32 @@ class RLSystem:
             mcts.manual_set_root(self.sim_world.get_current_encoded_state())
         else:
             root = mcts.get_root()
-            for search_game_num in range(search_games):
-                mcts.run_search_game(self.actor, self.epsilon)
+            mcts.run_search(self.actor, self.epsilon, search_games)
             prev_root = root
             root, dist = mcts.move_next_root()
             self.episode_buffer.append((prev_root.state, dist))
             self.sim_world.set_current_state(root.state, root.player)
        
 
+    def close_search(self):
+        if self.mcts is not None:
+            self.mcts.close()
+            self.mcts = None
+
     def update_buffers(self, winner):
+        self.replay_buffer.extend(self.episode_samples(winner))
+
+    def episode_samples(self, winner):
         self.episode_buffer = list(filter(lambda b: b[0][len(b[0]) - 1] == winner, self.episode_buffer))
-        self.replay_buffer.extend(self.episode_buffer)
+        return self.augmented(self.episode_buffer)
+
+    def augmented(self, samples):
+        augmented_samples = list(samples)
+        if self.augment:
+            # Symmetric copies of each position with the dist permuted to match
+            for state, dist in samples:
+                augmented_samples.extend(self.sim_world.get_symmetries(state, dist))
+        return augmented_samples
 
     def reset_episode_data(self):
         self.episode_buffer = []
@@ -66,13 +177,16 @@ class RLSystem:
     
     def save_replay_buffer(self, filepath):
         fullpath = os.getcwd() + filepath[1:].replace("/", os.sep)
-        with open(f"{fullpath}{os.sep}replay_buffer.pickle", "wb") as f:
-            pickle.dump(self.replay_buffer, f)
+        self.replay_buffer.save(f"{fullpath}{os.sep}replay")
     
     def load_replay_buffer(self, filepath):
         fullpath = os.getcwd() + filepath[1:].replace("/", os.sep)
+        if os.path.exists(f"{fullpath}{os.sep}replay"):
+            self.replay_buffer.load(f"{fullpath}{os.sep}replay")
+            return
+        # Runs saved before the segment format have the whole buffer pickled as a list of samples
         with open(f"{fullpath}{os.sep}replay_buffer.pickle", "rb") as f:
-            self.replay_buffer = pickle.load(f)
+            self.replay_buffer.extend(pickle.load(f))
     
     def set_opponent(self, opponent: Actor):
         self.opponent = opponent
\ No newline at end of file
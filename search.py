@@ -0,0 +1,15 @@
+from array_mcts import ArrayMonteCarloTreeSearch
+from mcts import MCTS_Parameters, MonteCarloTreeSearch
+from parallel_mcts import RootParallelMonteCarloTreeSearch, TreeParallelMonteCarloTreeSearch
+from simworlds.simworld import SimWorld
+
+
+def new_mcts(sim_world: SimWorld, params: MCTS_Parameters = None):
+    params = params if params else MCTS_Parameters()
+    if params.workers > 1 and params.parallel == "tree":
+        return TreeParallelMonteCarloTreeSearch(sim_world, params)
+    if params.workers > 1:
+        return RootParallelMonteCarloTreeSearch(sim_world, params)
+    if params.tree == "array":
+        return ArrayMonteCarloTreeSearch(sim_world, params)
+    return MonteCarloTreeSearch(sim_world, params)
@@ -0,0 +1,33 @@
+import queue
+import random
+import numpy as np
+
+from mcts import MCTS_Parameters
+from replay_buffer import ReplayBufferParams
+from simworlds.simworld import SimWorld
+
+
+def run_self_play_worker(sim_world: SimWorld, learner_class, learner_params, mcts_params: MCTS_Parameters, search_games, augment, cache_size, sample_queue, weight_queue, stop_event):
+    # Runs in its own process, playing episodes with the newest published weights and streaming the samples back.
+    # The learner is rebuilt from its class and params here, only weights are sent between the processes
+    from rl import RLSystem
+    random.seed()
+    np.random.seed()
+    rl_system = RLSystem(sim_world, learner_class(learner_params), mcts_params=mcts_params, replay_params=ReplayBufferParams(1), augment=augment, cache_size=cache_size)
+    has_weights = False
+    while not stop_event.is_set():
+        # Wait for the first weights, after that only pick up the newest ones published during the last episode
+        published = None
+        try:
+            published = weight_queue.get(block=not has_weights, timeout=1)
+            while True:
+                published = weight_queue.get_nowait()
+        except queue.Empty:
+            pass
+        if published is not None:
+            weights, rl_system.epsilon = published
+            rl_system.actor.set_learner_weights(weights)
+            has_weights = True
+        if has_weights:
+            sample_queue.put(rl_system.play_episode(search_games))
+    rl_system.close_search()
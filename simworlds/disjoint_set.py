@@ -0,0 +1,43 @@
+class DisjointSet:
+    """
+    Union-find over the integers 0..count-1 with union by size.
+
+    Path compression is left out so that every union can be undone: rollback() pops
+    unions off the history until it is back at a previous mark().
+    """
+
+    def __init__(self, count):
+        self.parent = list(range(count))
+        self.sizes = [1] * count
+        self.history = []
+
+    def find(self, node):
+        parent = self.parent
+        while parent[node] != node:
+            node = parent[node]
+        return node
+
+    def union(self, a, b):
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return
+        if self.sizes[a] < self.sizes[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.sizes[a] += self.sizes[b]
+        self.history.append(b)
+
+    def connected(self, a, b):
+        return self.find(a) == self.find(b)
+
+    def mark(self):
+        return len(self.history)
+
+    def rollback(self, mark):
+        while len(self.history) > mark:
+            b = self.history.pop()
+            a = self.parent[b]
+            self.sizes[a] -= self.sizes[b]
+            self.parent[b] = b
+
@@ -1,8 +1,13 @@
 import math
+import numpy as np
 from queue import Queue
 from xmlrpc.client import boolean
 
 from matplotlib import pyplot as plt
+from simworlds.disjoint_set import DisjointSet
+from simworlds.hex_batch import HexGameBatch
+from simworlds.hex_patterns import HexPatterns
+from simworlds.hex_tactics import HexTactics
 from simworlds.simworld import SimWorld
 
 class HexBoard:
@@ -49,9 +54,14 @@ class HexBoard:
 
 class HexGame(SimWorld):
 
-    def __init__(self, size):
+    def __init__(self, size, prune_actions=False):
         self.size = size
         self.board = None
+        self.tactics = HexTactics(size)
+        self.patterns = HexPatterns(size)
+        self.prune_actions = prune_actions
+        self.actions = [(i, j) for i in range(size) for j in range(size)]
+        self.action_indexes = {action: i for i, action in enumerate(self.actions)}
         self.start_player = True
         self.player_turn = self.start_player # True = "BLACK", False = "RED"
         self.produce_init_state()
@@ -62,9 +72,48 @@ class HexGame(SimWorld):
     def produce_init_state(self):
         self.player_turn = self.start_player
         self.board = HexBoard(self.size)
+        self.move_stack = []
+        self.init_connections()
+
+    def init_connections(self):
+        # Cells are nodes 0..size^2-1, followed by virtual nodes for the four board edges
+        cell_count = self.size * self.size
+        self.empty_count = cell_count
+        self.black_edges = (cell_count, cell_count + 1)
+        self.red_edges = (cell_count + 2, cell_count + 3)
+        self.connections = DisjointSet(cell_count + 4)
+        self.connection_marks = []
+
+    def connect_stone(self, row, column, row_team):
+        self.connection_marks.append(self.connections.mark())
+        self.empty_count -= 1
+        index = row * self.size + column
+        node_type = (1, 0) if row_team else (0, 1)
+        for nrow, ncolumn in self.get_neighbors(row, column):
+            if self.get_cell(nrow, ncolumn) == node_type:
+                self.connections.union(index, nrow * self.size + ncolumn)
+        edge_position = column if row_team else row
+        edges = self.black_edges if row_team else self.red_edges
+        if edge_position == 0:
+            self.connections.union(index, edges[0])
+        if edge_position == self.size - 1:
+            self.connections.union(index, edges[1])
+
+    def rebuild_connections(self):
+        self.init_connections()
+        for row in range(self.size):
+            for column in range(self.size):
+                cell = self.get_cell(row, column)
+                if cell != (0, 0):
+                    self.connect_stone(row, column, cell == (1, 0))
+        self.connection_marks = []
 
     def get_action_space(self):
-        return [(i, j) for i in range(self.size) for j in range(self.size)]
+        # The cached list is shared, callers must not modify it
+        return self.actions
+
+    def get_action_index(self, action):
+        return self.action_indexes[action]
 
     def get_legal_actions(self):
         actions = []
@@ -75,27 +124,29 @@ class HexGame(SimWorld):
                     actions.append((i, j))
         return actions
 
+    def get_legal_mask(self):
+        # Boolean array over the action space, True for the empty cells
+        return np.array(self.get_current_encoded_state()[:-1]).reshape(-1, 2).sum(axis=1) == 0
+
+    def get_pruned_mask(self):
+        if not self.prune_actions:
+            return self.get_legal_mask()
+        mask = np.zeros(len(self.actions), dtype=bool)
+        mask[[self.get_action_index(action) for action in self.get_pruned_actions()]] = True
+        return mask
+
     def perform_action(self, action):
         self.board.set_cell(action[0], action[1], (1, 0) if self.player_turn else (0, 1))
+        self.connect_stone(action[0], action[1], self.player_turn)
+        self.move_stack.append((action, self.player_turn))
         self.player_turn = not self.player_turn
 
-    def bfs(self, start_nodes, end_nodes, node_type):
-        visited = set([])
-        queue = Queue()
-        for node in start_nodes:
-            if self.board.get_cell(node[0], node[1]) == node_type:
-                queue.put(node)
-                visited.add(node)
-        while not queue.empty():
-            node = queue.get()
-            if node in end_nodes:
-                return True
-            neighbors = self.board.get_neighbors(node[0], node[1])
-            for next_node in neighbors:
-                if self.board.get_cell(next_node[0], next_node[1]) == node_type and next_node not in visited:
-                    queue.put(next_node)
-                    visited.add(next_node)
-        return False
+    def undo_action(self):
+        action, player = self.move_stack.pop()
+        self.board.set_cell(action[0], action[1], (0, 0))
+        self.connections.rollback(self.connection_marks.pop())
+        self.empty_count += 1
+        self.player_turn = player
 
     def bfs_tree_neighbors(self, start_node, node_type):
         visited = set([])
@@ -119,13 +170,15 @@ class HexGame(SimWorld):
     def get_neighbors(self, row, column):
         return self.board.get_neighbors(row, column)
 
+    def get_cell(self, row, column):
+        return self.board.get_cell(row, column)
+
     def is_team_winning(self, row_team):
-        start_nodes = [(i, 0)             for i in range(self.size)] if row_team else [(0, j)             for j in range(self.size)]
-        end_nodes   = [(i, self.size - 1) for i in range(self.size)] if row_team else [(self.size - 1, j) for j in range(self.size)]
-        return self.bfs(start_nodes, end_nodes, (1, 0) if row_team else (0, 1))
+        edges = self.black_edges if row_team else self.red_edges
+        return self.connections.connected(edges[0], edges[1])
 
     def is_final_state(self):
-        return self.is_team_winning(True) or self.is_team_winning(False) or len(self.get_legal_actions()) == 0
+        return self.is_team_winning(True) or self.is_team_winning(False) or self.empty_count == 0
 
     def get_reward(self):
         return 1 if self.is_team_winning(True) else -1 if self.is_team_winning(False) else 0 
@@ -136,6 +189,43 @@ class HexGame(SimWorld):
         # print(tuple(state_list))
         return tuple(state_list)
     
+    def get_state_key(self):
+        return self.get_current_encoded_state()
+
+    def get_tactical_analyzer(self):
+        return self.tactics
+
+    def get_pruned_actions(self):
+        # Legal actions without dead cells, and only the must-play cells when the opponent has a semi-connection
+        if not self.prune_actions:
+            return self.get_legal_actions()
+        legal_cells = [self.get_action_index(action) for action in self.get_legal_actions()]
+        return [self.actions[cell] for cell in self.patterns.prune(self.get_current_encoded_state(), self.get_current_player(), legal_cells)]
+
+    def get_batch(self, games):
+        return HexGameBatch(self.size, games, self.start_player)
+
+    def get_symmetries(self, encoded_state, dist):
+        # A 180 degree rotation keeps both players' goals. A transpose swaps them, so transposed boards also swap the
+        # colours and the player to move. Returns the distinct symmetric (state, dist) pairs other than the input
+        board = np.array(encoded_state[:-1]).reshape(self.size, self.size, 2)
+        dist = np.array(dist).reshape(self.size, self.size)
+        player = encoded_state[-1]
+        rotated_board, rotated_dist = board[::-1, ::-1], dist[::-1, ::-1]
+        transforms = [
+            (rotated_board, rotated_dist, player),
+            (board.transpose(1, 0, 2)[:, :, ::-1], dist.T, 1 - player),
+            (rotated_board.transpose(1, 0, 2)[:, :, ::-1], rotated_dist.T, 1 - player),
+        ]
+        seen = {tuple(encoded_state)}
+        symmetries = []
+        for sym_board, sym_dist, sym_player in transforms:
+            sym_state = tuple(sym_board.flatten().tolist()) + (sym_player, )
+            if sym_state not in seen:
+                seen.add(sym_state)
+                symmetries.append((sym_state, sym_dist.flatten().tolist()))
+        return symmetries
+
     def get_current_player(self):
         return self.player_turn
 
@@ -148,14 +238,19 @@ class HexGame(SimWorld):
                 index = (row * self.size + column) * 2
                 cell = (encoded_state[index + 0], encoded_state[index + 1])
                 self.board.set_cell(row, column, cell)
+        self.rebuild_connections()
+        self.move_stack = []
+        self.player_turn = player
+
+    def set_current_player(self, player):
         self.player_turn = player
     
     def visualize_state(self, ax):
         center_point = (self.size / 2, self.size / 2)
         for i in range(self.size):
             for j in range(self.size):
-                cell = self.board.get_cell(i, j)
-                neighbors = self.board.get_neighbors(i, j)
+                cell = self.get_cell(i, j)
+                neighbors = self.get_neighbors(i, j)
                 rot_angle = -math.pi / 4
                 point = self.rotate(center_point, (j, self.size - i), rot_angle)
                 for n_pos in neighbors:
@@ -0,0 +1,95 @@
+import numpy as np
+
+EMPTY = 0
+BLACK = 1
+RED = 2
+
+
+class HexGameBatch:
+    """
+    Many Hex games stored as one stacked board array and played in lockstep.
+
+    boards has shape (games, size, size) with cells EMPTY, BLACK or RED, and actions are
+    indexes into HexGame's action space (row * size + column). Encoded states match
+    HexGame.get_current_encoded_state, so the same learners can play both. Black connects
+    the first and last column and red the first and last row, like in HexGame.
+    """
+
+    def __init__(self, size, games, start_player=True):
+        self.size = size
+        self.games = games
+        self.start_player = start_player
+        self.produce_init_state()
+
+    def produce_init_state(self, start_players=None):
+        # start_players can give each game its own starting player, otherwise all games start with start_player
+        self.boards = np.zeros((self.games, self.size, self.size), dtype=np.int8)
+        self.players = np.full(self.games, self.start_player, dtype=bool) if start_players is None else np.array(start_players, dtype=bool)
+        self.rewards = np.zeros(self.games, dtype=np.int8)
+
+    def get_action_space(self):
+        return [(i, j) for i in range(self.size) for j in range(self.size)]
+
+    def get_legal_masks(self):
+        masks = self.boards.reshape(self.games, -1) == EMPTY
+        masks[self.is_final_states()] = False
+        return masks
+
+    def get_encoded_states(self):
+        cells = self.boards.reshape(self.games, -1)
+        states = np.empty((self.games, 2 * self.size * self.size + 1), dtype=np.int8)
+        states[:, 0:-1:2] = cells == BLACK
+        states[:, 1:-1:2] = cells == RED
+        states[:, -1] = self.players
+        return states
+
+    def get_current_players(self):
+        return self.players.copy()
+
+    def is_final_states(self):
+        return self.rewards != 0
+
+    def all_final(self):
+        return bool(self.is_final_states().all())
+
+    def get_rewards(self):
+        # 1 when black won, -1 when red won and 0 for games still running
+        return self.rewards.copy()
+
+    def perform_actions(self, actions, games=None):
+        # Play actions[k] in game games[k], all running games when games is None
+        games = np.flatnonzero(~self.is_final_states()) if games is None else np.asarray(games)
+        actions = np.asarray(actions)
+        rows, columns = actions // self.size, actions % self.size
+        self.boards[games, rows, columns] = np.where(self.players[games], BLACK, RED)
+        self.players[games] = ~self.players[games]
+        self.update_rewards(games)
+
+    def update_rewards(self, games):
+        boards = self.boards[games]
+        black_won = self.connected(boards == BLACK)
+        red_won = self.connected((boards == RED).transpose(0, 2, 1))
+        self.rewards[games] = np.where(black_won, 1, np.where(red_won, -1, 0))
+
+    @staticmethod
+    def dilate(cells):
+        # Grow every stone into its six neighbours, (-1, 0), (-1, 1), (0, 1), (1, 0), (1, -1) and (0, -1)
+        grown = cells.copy()
+        grown[:, 1:, :] |= cells[:, :-1, :]
+        grown[:, :-1, :] |= cells[:, 1:, :]
+        grown[:, :, 1:] |= cells[:, :, :-1]
+        grown[:, :, :-1] |= cells[:, :, 1:]
+        grown[:, 1:, :-1] |= cells[:, :-1, 1:]
+        grown[:, :-1, 1:] |= cells[:, 1:, :-1]
+        return grown
+
+    def connected(self, stones):
+        # Flood fill from the first column of every board at once, and check which fills reach the last column.
+        # Red boards are passed in transposed, the hex neighbourhood is symmetric under the transpose
+        reached = np.zeros_like(stones)
+        reached[:, :, 0] = stones[:, :, 0]
+        while True:
+            grown = self.dilate(reached) & stones
+            if (grown == reached).all():
+                return reached[:, :, -1].any(axis=1)
+            reached = grown
@@ -0,0 +1,145 @@
+import numpy as np
+
+from simworlds.hex import HexBoard, HexGame
+
+
+class BitboardHexGame(HexGame):
+    """
+    HexGame backed by two integer bitboards, one for each player.
+
+    Cell (row, column) is stored in bit row * size + column. The encoded state is kept
+    as a flat list that is updated in place on every move, and the tuple handed out by
+    get_current_encoded_state() is cached until the next move, so repeated encodes and
+    decodes of the same position are cheap.
+    """
+
+    def __init__(self, size, prune_actions=False):
+        self.cell_count = size * size
+        self.full_mask = (1 << self.cell_count) - 1
+        first_column = sum(1 << (row * size) for row in range(size))
+        last_column = first_column << (size - 1)
+        self.first_column_mask = first_column
+        self.last_column_mask = last_column
+        self.first_row_mask = (1 << size) - 1
+        self.last_row_mask = self.first_row_mask << (size * (size - 1))
+        self.not_first_column_mask = self.full_mask & ~first_column
+        self.not_last_column_mask = self.full_mask & ~last_column
+        self.actions = [(i, j) for i in range(size) for j in range(size)]
+        self.neighbor_table = [HexBoard(size).get_neighbors(i, j) for (i, j) in self.actions]
+        super().__init__(size, prune_actions)
+
+    def produce_init_state(self):
+        self.player_turn = self.start_player
+        self.black = 0
+        self.red = 0
+        self.move_stack = []
+        self.encoded = [0] * (self.cell_count * 2 + 1)
+        self.encoded[-1] = int(self.player_turn)
+        self.encoded_cache = None
+        self.init_connections()
+
+    def get_legal_actions(self):
+        empty = ~(self.black | self.red) & self.full_mask
+        return [self.actions[i] for i in range(self.cell_count) if empty >> i & 1]
+
+    def get_legal_mask(self):
+        # Unpack the empty cells' bits little endian, so bit i lands on action i
+        empty = ~(self.black | self.red) & self.full_mask
+        bits = np.frombuffer(empty.to_bytes((self.cell_count + 7) // 8, "little"), dtype=np.uint8)
+        return np.unpackbits(bits, bitorder="little")[:self.cell_count].astype(bool)
+
+    def perform_action(self, action):
+        index = action[0] * self.size + action[1]
+        if self.player_turn:
+            self.black |= 1 << index
+            self.encoded[index * 2] = 1
+        else:
+            self.red |= 1 << index
+            self.encoded[index * 2 + 1] = 1
+        self.connect_stone(action[0], action[1], self.player_turn)
+        self.move_stack.append((index, self.player_turn))
+        self.player_turn = not self.player_turn
+        self.encoded[-1] = int(self.player_turn)
+        self.encoded_cache = None
+
+    def undo_action(self):
+        index, player = self.move_stack.pop()
+        bit = ~(1 << index)
+        self.black &= bit
+        self.red &= bit
+        self.encoded[index * 2] = 0
+        self.encoded[index * 2 + 1] = 0
+        self.connections.rollback(self.connection_marks.pop())
+        self.empty_count += 1
+        self.player_turn = player
+        self.encoded[-1] = int(self.player_turn)
+        self.encoded_cache = None
+
+    def dilate(self, bits):
+        # Grow a set of cells by one step in all six hex directions
+        s = self.size
+        return (bits | (bits << s) | (bits >> s)
+                | ((bits << 1) & self.not_first_column_mask)
+                | ((bits >> 1) & self.not_last_column_mask)
+                | ((bits >> (s - 1)) & self.not_first_column_mask)
+                | ((bits << (s - 1)) & self.not_last_column_mask)) & self.full_mask
+
+    def flood_fill(self, start, stones):
+        reach = start & stones
+        while True:
+            grown = self.dilate(reach) & stones
+            if grown == reach:
+                return reach
+            reach = grown
+
+    def bfs_tree_neighbors(self, start_node, node_type):
+        stones = self.black if node_type == (1, 0) else self.red if node_type == (0, 1) else 0
+        start = 1 << (start_node[0] * self.size + start_node[1])
+        if not start & stones:
+            return []
+        chain = self.flood_fill(start, stones)
+        empty = ~(self.black | self.red) & self.full_mask
+        border = self.dilate(chain) & empty
+        return [self.actions[i] for i in range(self.cell_count) if border >> i & 1]
+
+    def get_neighbors(self, row, column):
+        return list(self.neighbor_table[row * self.size + column])
+
+    def get_cell(self, row, column):
+        bit = 1 << (row * self.size + column)
+        return (1, 0) if self.black & bit else (0, 1) if self.red & bit else (0, 0)
+
+    def get_current_encoded_state(self):
+        if self.encoded_cache is None:
+            self.encoded_cache = tuple(self.encoded)
+        return self.encoded_cache
+
+    def set_current_player(self, player):
+        self.player_turn = player
+        self.encoded[-1] = int(player)
+        self.encoded_cache = None
+
+    def get_state_key(self):
+        return (self.black, self.red, self.player_turn)
+
+    def set_current_state(self, encoded_state, player):
+        self.move_stack = []
+        self.connection_marks = []
+        board_length = self.cell_count * 2
+        board = list(encoded_state[:board_length])
+        if self.player_turn == player and board == self.encoded[:board_length]:
+            return
+        black = 0
+        red = 0
+        for index in range(self.cell_count):
+            if board[index * 2]:
+                black |= 1 << index
+            elif board[index * 2 + 1]:
+                red |= 1 << index
+        self.black = black
+        self.red = red
+        self.encoded = board
+        self.encoded.append(int(player))
+        self.player_turn = player
+        self.encoded_cache = None
+        self.rebuild_connections()
@@ -0,0 +1,165 @@
+from collections import deque
+
+from simworlds.hex_tactics import BLACK, EMPTY, RED, decode_cells
+
+DIRECTIONS = [(-1, 0), (-1, 1), (0, 1), (1, 0), (1, -1), (0, -1)]
+
+# Codes for the positions around the board, past the first or last column (black's edges) or row (red's edges)
+BLACK_FIRST = -1
+BLACK_LAST = -2
+RED_FIRST = -3
+RED_LAST = -4
+OUTSIDE = -5
+EDGE_CODES = {BLACK: (BLACK_FIRST, BLACK_LAST), RED: (RED_FIRST, RED_LAST)}
+
+
+class HexPatterns:
+    """
+    Bridge and edge template aware move pruning for Hex.
+
+    A bridge joins two stones of a colour that share two empty neighbours, its carrier. An
+    edge template is the same shape with the board edge in place of the second stone. The
+    chains of a colour, linked by bridges and edge templates, plus at most one empty cell
+    that joins two of them, form a semi-connection between the colour's edges when their
+    carriers are disjoint. If the opponent has one, every move of the player outside its
+    carrier loses, so the carrier is the must-play set.
+
+    Dead cells are empty cells with four consecutive neighbours of one colour, counting the
+    positions past the board edges as stones of the colour owning that edge. Playing a dead
+    cell never changes the winner, so those cells are inferior moves.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.cell_count = size * size
+        self.ring = []
+        self.bridges = []
+        for row in range(size):
+            for column in range(size):
+                ring = [self.position(row + i, column + j) for i, j in DIRECTIONS]
+                bridges = []
+                for k in range(6):
+                    first, second = ring[k], ring[(k + 1) % 6]
+                    if first >= 0 and second >= 0:
+                        i, j = DIRECTIONS[k][0] + DIRECTIONS[(k + 1) % 6][0], DIRECTIONS[k][1] + DIRECTIONS[(k + 1) % 6][1]
+                        bridges.append((self.position(row + i, column + j), first, second))
+                self.ring.append(ring)
+                self.bridges.append(bridges)
+
+    def position(self, row, column):
+        # Index of a cell on the board, or the code of the edge past which the position lies
+        row_inside = 0 <= row < self.size
+        column_inside = 0 <= column < self.size
+        if row_inside and column_inside:
+            return row * self.size + column
+        if row_inside:
+            return BLACK_FIRST if column < 0 else BLACK_LAST
+        if column_inside:
+            return RED_FIRST if row < 0 else RED_LAST
+        return OUTSIDE
+
+    def colour_at(self, cells, position):
+        if position >= 0:
+            return cells[position]
+        if position in EDGE_CODES[BLACK]:
+            return BLACK
+        if position in EDGE_CODES[RED]:
+            return RED
+        return EMPTY
+
+    def is_dead(self, cells, cell):
+        colours = [self.colour_at(cells, position) for position in self.ring[cell]]
+        for start in range(6):
+            colour = colours[start]
+            if colour != EMPTY and all(colours[(start + k) % 6] == colour for k in range(1, 4)):
+                return True
+        return False
+
+    def dead_cells(self, cells):
+        return {cell for cell in range(self.cell_count) if cells[cell] == EMPTY and self.is_dead(cells, cell)}
+
+    def must_play(self, cells, colour):
+        # The carrier of a semi-connection of colour between its edges, or None if none is found
+        chain_of = [-1] * self.cell_count
+        chains = 0
+        for start in range(self.cell_count):
+            if cells[start] != colour or chain_of[start] >= 0:
+                continue
+            chain_of[start] = chains
+            stack = [start]
+            while stack:
+                cell = stack.pop()
+                for neighbor in self.ring[cell]:
+                    if neighbor >= 0 and cells[neighbor] == colour and chain_of[neighbor] < 0:
+                        chain_of[neighbor] = chains
+                        stack.append(neighbor)
+            chains += 1
+        first_edge, last_edge = EDGE_CODES[colour]
+        component = {first_edge: chains, last_edge: chains + 1}
+
+        # Links between components as (component, carrier, gap), chains touching an edge are linked to it directly
+        links = [[] for _ in range(chains + 2)]
+        for cell in range(self.cell_count):
+            if cells[cell] == colour:
+                for position in self.ring[cell]:
+                    if position in component:
+                        links[chain_of[cell]].append((component[position], (), False))
+                        links[component[position]].append((chain_of[cell], (), False))
+                for target, first, second in self.bridges[cell]:
+                    if cells[first] != EMPTY or cells[second] != EMPTY:
+                        continue
+                    other = chain_of[target] if target >= 0 and cells[target] == colour else component.get(target, -1)
+                    if other >= 0 and other != chain_of[cell]:
+                        links[chain_of[cell]].append((other, (first, second), False))
+                        links[other].append((chain_of[cell], (first, second), False))
+            elif cells[cell] == EMPTY:
+                joined = set()
+                for position in self.ring[cell]:
+                    if position >= 0 and cells[position] == colour:
+                        joined.add(chain_of[position])
+                    elif position in component:
+                        joined.add(component[position])
+                for a in joined:
+                    for b in joined:
+                        if a != b:
+                            links[a].append((b, (cell, ), True))
+
+        # Breadth first search over (component, gaps used), taking links without a gap first
+        start, goal = (chains, 0), None
+        parents = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node[0] == chains + 1:
+                goal = node
+                break
+            for other, link_carrier, gap in links[node[0]]:
+                gaps = node[1] + gap
+                nxt = (other, gaps)
+                if gaps <= 1 and nxt not in parents:
+                    parents[nxt] = (node, link_carrier)
+                    if gaps == node[1]:
+                        queue.appendleft(nxt)
+                    else:
+                        queue.append(nxt)
+        if goal is None:
+            return None
+        carrier = []
+        node = goal
+        while parents[node] is not None:
+            node, cells_used = parents[node]
+            carrier.extend(cells_used)
+        # Overlapping carriers can be broken with one move, and an empty carrier means the game is already won
+        if not carrier or len(set(carrier)) != len(carrier):
+            return None
+        return set(carrier)
+
+    def prune(self, encoded_state, player, legal_cells):
+        # Legal cells that are in the must-play set and not dead, falling back to the larger set when that leaves nothing
+        cells = decode_cells(encoded_state, self.cell_count)
+        carrier = self.must_play(cells, RED if player else BLACK)
+        candidates = [cell for cell in legal_cells if carrier is None or cell in carrier]
+        if not candidates:
+            candidates = legal_cells
+        live = [cell for cell in candidates if not self.is_dead(cells, cell)]
+        return live if live else candidates
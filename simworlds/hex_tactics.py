@@ -0,0 +1,148 @@
+EMPTY = 0
+BLACK = 1
+RED = 2
+
+
+def decode_cells(encoded_state, cell_count):
+    return [BLACK if encoded_state[2 * i] else RED if encoded_state[2 * i + 1] else EMPTY for i in range(cell_count)]
+
+
+class HexTactics:
+    """
+    Finds the tactical actions of Actor's check_winning, check_losing, check_winning_fork and
+    check_losing_fork from one labelling of the board into chains.
+
+    Every chain keeps the set of board edges of its colour it touches, as two flag bits, and
+    its liberties. A cell's flags are its own edges plus those of the adjacent chains of a
+    colour, so a move wins when its flags cover both edges. A fork is a move whose new chain
+    has at least two liberties that would each win the game. Like the check_* methods,
+    the last matching action in action space order is found, and returned as its index.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.cell_count = size * size
+        positions = [(i, j) for i in range(size) for j in range(size)]
+        neighbor_indexes = [(-1, 0), (-1, 1), (0, 1), (1, 0), (1, -1), (0, -1)]
+        self.neighbors = []
+        for row, column in positions:
+            self.neighbors.append([(row + i) * size + column + j for i, j in neighbor_indexes if 0 <= row + i < size and 0 <= column + j < size])
+        # Black connects the first and last column, red the first and last row
+        self.edge_flags = {
+            BLACK: [int(column == 0) | int(column == size - 1) << 1 for row, column in positions],
+            RED: [int(row == 0) | int(row == size - 1) << 1 for row, column in positions],
+        }
+
+    def get_tactical_action(self, encoded_state, player, quad_forks=False):
+        # Same order as Actor.get_tactical_action: win, block the opponent's win, make a fork, block the opponent's fork,
+        # and with quad_forks make or block a move that threatens two forks
+        cells = decode_cells(encoded_state, self.cell_count)
+        own, other = (BLACK, RED) if player else (RED, BLACK)
+        own_analysis = self.analyze(cells, own)
+        other_analysis = self.analyze(cells, other)
+        for find, analysis in ((self.find_win, own_analysis), (self.find_win, other_analysis), (self.find_fork, own_analysis), (self.find_fork, other_analysis)):
+            action = find(cells, analysis)
+            if action is not None:
+                return action
+        if quad_forks:
+            for colour, analysis in ((own, own_analysis), (other, other_analysis)):
+                action = self.find_quad_fork(cells, colour, analysis)
+                if action is not None:
+                    return action
+        return None
+
+    def analyze(self, cells, colour):
+        # Label the chains of one colour, then give every empty cell the edge flags it would have if colour played there
+        chain_of = [-1] * self.cell_count
+        chain_flags = []
+        chain_liberties = []
+        edge_flags = self.edge_flags[colour]
+        for start in range(self.cell_count):
+            if cells[start] != colour or chain_of[start] >= 0:
+                continue
+            chain = len(chain_flags)
+            chain_of[start] = chain
+            flags = 0
+            liberties = set()
+            stack = [start]
+            while stack:
+                cell = stack.pop()
+                flags |= edge_flags[cell]
+                for neighbor in self.neighbors[cell]:
+                    if cells[neighbor] == colour and chain_of[neighbor] < 0:
+                        chain_of[neighbor] = chain
+                        stack.append(neighbor)
+                    elif cells[neighbor] == EMPTY:
+                        liberties.add(neighbor)
+            chain_flags.append(flags)
+            chain_liberties.append(liberties)
+
+        cell_flags = [0] * self.cell_count
+        cell_chains = [()] * self.cell_count
+        for cell in range(self.cell_count):
+            if cells[cell] == EMPTY:
+                chains = {chain_of[neighbor] for neighbor in self.neighbors[cell] if chain_of[neighbor] >= 0}
+                flags = edge_flags[cell]
+                for chain in chains:
+                    flags |= chain_flags[chain]
+                cell_flags[cell] = flags
+                cell_chains[cell] = chains
+        return cell_flags, cell_chains, chain_liberties
+
+    def find_win(self, cells, analysis):
+        cell_flags = analysis[0]
+        found = None
+        for cell in range(self.cell_count):
+            if cells[cell] == EMPTY and cell_flags[cell] == 3:
+                found = cell
+        return found
+
+    def new_chain_liberties(self, cells, analysis, cell):
+        # The liberties of the chain a move on cell creates
+        cell_flags, cell_chains, chain_liberties = analysis
+        liberties = {neighbor for neighbor in self.neighbors[cell] if cells[neighbor] == EMPTY}
+        for chain in cell_chains[cell]:
+            liberties |= chain_liberties[chain]
+        liberties.discard(cell)
+        return liberties
+
+    def find_fork(self, cells, analysis):
+        cell_flags = analysis[0]
+        found = None
+        for cell in range(self.cell_count):
+            if cells[cell] != EMPTY:
+                continue
+            liberties = self.new_chain_liberties(cells, analysis, cell)
+            flags = cell_flags[cell]
+            wins = 0
+            for liberty in liberties:
+                if flags | cell_flags[liberty] == 3:
+                    wins += 1
+                    if wins == 2:
+                        found = cell
+                        break
+        return found
+
+    def find_quad_fork(self, cells, colour, analysis):
+        # A move whose new chain has two liberties that each leave colour with a fork, or with the game already won
+        cell_flags = analysis[0]
+        found = None
+        for cell in range(self.cell_count):
+            if cells[cell] != EMPTY:
+                continue
+            liberties = self.new_chain_liberties(cells, analysis, cell)
+            cells[cell] = colour
+            forks = 0
+            for liberty in liberties:
+                if cell_flags[cell] | cell_flags[liberty] == 3:
+                    forks += 1
+                else:
+                    cells[liberty] = colour
+                    if self.find_fork(cells, self.analyze(cells, colour)) is not None:
+                        forks += 1
+                    cells[liberty] = EMPTY
+                if forks == 2:
+                    found = cell
+                    break
+            cells[cell] = EMPTY
+        return found
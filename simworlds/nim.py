@@ -1,3 +1,4 @@
+import numpy as np
 from matplotlib.patches import Rectangle
 from simworlds.simworld import SimWorld
 
@@ -10,20 +11,36 @@ class Nim(SimWorld):
         self.max_move = max_move
         self.start_player_turn = start_player
         self.player_turn = start_player
+        self.move_stack = []
 
     def produce_init_state(self):
         self.pieces = self.start_pieces
         self.player_turn = self.start_player_turn
+        self.move_stack = []
 
     def get_action_space(self):
         return [i for i in range(1, self.max_move + 1)]
 
+    def get_action_index(self, action):
+        return action - 1
+
+    def get_legal_mask(self):
+        return np.arange(1, self.max_move + 1) <= self.pieces
+
+    def get_pruned_mask(self):
+        return self.get_legal_mask()
+
     def get_legal_actions(self):
         # print(self.max_move, self.pieces)
         return [action for action in range(1, min(self.max_move, self.pieces) + 1)]
     
     def perform_action(self, action):
         self.pieces -= action
+        self.move_stack.append(action)
+        self.player_turn = not self.player_turn
+
+    def undo_action(self):
+        self.pieces += self.move_stack.pop()
         self.player_turn = not self.player_turn
     
     def is_final_state(self):
@@ -39,6 +56,21 @@ class Nim(SimWorld):
     def get_current_encoded_state(self):
         return (self.pieces, self.player_turn)
     
+    def get_state_key(self):
+        return self.get_current_encoded_state()
+
+    def get_symmetries(self, encoded_state, dist):
+        return []
+
+    def get_batch(self, games):
+        return None
+
+    def get_tactical_analyzer(self):
+        return None
+
+    def get_pruned_actions(self):
+        return self.get_legal_actions()
+
     def get_encoding_shape(self):
         return (2, )
 
@@ -47,6 +79,7 @@ class Nim(SimWorld):
 
     def set_current_state(self, encoded_state, player):
         self.pieces = encoded_state[0]
+        self.move_stack = []
         self.player_turn = player
     
     def set_current_player(self, player_turn):
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class StateCache:
+    """
+    Bounded least recently used cache of per-state results, keyed by encoded state.
+
+    Once the cache holds capacity entries, every new entry evicts the least recently used
+    one. A cache for learner outputs is tagged with the learner version it was filled
+    with, and validate() empties it when the learner has been trained or loaded since.
+    Hits and misses are counted for the cache's lifetime, clearing does not reset them.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        # Returns MISSING rather than None on a miss, since None is a valid cached value
+        value = self.entries.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def validate(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate():.1%}), {len(self.entries)} of {self.capacity} entries"
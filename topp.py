@@ -1,19 +1,55 @@
+import multiprocessing
 import time
 import os
 import json
+import numpy as np
 from math import floor
 from actor import Actor
 from learners.anet import ActorNeuralNetwork
 from learners.dtrees import DecisionTrees
 from learners.learner import Learner
+from mcts import MCTS_Parameters
+from replay_buffer import ReplayBufferParams
 from rl import RLSystem
 from simworlds.simworld import SimWorld
+from state_cache import StateCache
+from topp_worker import init_topp_worker, run_topp_match
 from visualizer import Visualizer
 
+def play_match(sim_world: SimWorld, visualizer: Visualizer, p1_name, p1: Actor, p2_name, p2: Actor, search_games, search_game_delay, time_limit=0, quad_forks=False):
+    # p1 plays black and p2 red, returns the reward of the final state
+    sim_world.produce_init_state()
+    visualizer.init_visualize_episode(title=f"{p1_name} (BLACK) vs {p2_name} (RED)")
+    move_count = 0
+    while not sim_world.is_final_state():
+        visualizer.visualize_state()
+        t = time.time()
+        action = sim_world.get_action_space()[0]
+        move_search_games = search_games if move_count > search_game_delay else 0
+        move_time_limit = time_limit if move_count > search_game_delay else 0
+        if sim_world.get_current_player():
+            action = p1.get_action(sim_world.get_current_encoded_state(), 0, mcts_episodes=move_search_games, time_limit=move_time_limit, quad_forks=quad_forks)
+        else:
+            action = p2.get_action(sim_world.get_current_encoded_state(), 0, mcts_episodes=move_search_games, time_limit=move_time_limit, quad_forks=quad_forks)
+        # print(sim_world.get_current_encoded_state(), action)
+        sim_world.perform_action(action)
+        # print(action, sim_world.get_current_encoded_state())
+        d = time.time() - t
+        if d > 1:
+            print("Time taken: ", d, d < 1)
+        move_count += 1
+    visualizer.visualize_final_state()
+    result = sim_world.get_reward()
+    print("Result: ", result)
+    print()
+    return result
+
+
 class TOPP:
 
-    def __init__(self, sim_world: SimWorld, player_count, games_count, total_episodes, train_search_games, topp_search_games, topp_search_game_delay, learner: Learner, train_visualize=False, tournament_visualize=False, frame_delay=0.25, train_epsilon=0.15):
+    def __init__(self, sim_world: SimWorld, player_count, games_count, total_episodes, train_search_games, topp_search_games, topp_search_game_delay, learner: Learner, topp_time_limit=0, train_visualize=False, tournament_visualize=False, frame_delay=0.25, train_epsilon=0.15, mcts_params: MCTS_Parameters = None, replay_params: ReplayBufferParams = None, augment=False, self_play_workers=1, weight_refresh=1, batch_games=0, topp_batch=False, quad_forks=False, cache_size=0, topp_workers=1):
         self.sim_world = sim_world
+        self.mcts_params = mcts_params
         self.player_count = player_count
         self.init_episodes = 0
         self.total_episodes = total_episodes
@@ -21,9 +57,16 @@ class TOPP:
         self.games_count = games_count
         self.topp_search_games = topp_search_games
         self.topp_search_game_delay = topp_search_game_delay
+        self.topp_time_limit = topp_time_limit
+        self.topp_batch = topp_batch
+        self.topp_workers = topp_workers
+        self.quad_forks = quad_forks
+        self.cache_size = cache_size
+        # Tactical actions don't depend on the learner, so all players share one cache
+        self.tactical_cache = StateCache(cache_size) if cache_size else None
         self.train_epsilon = train_epsilon
         self.learner = learner
-        self.rl_system = RLSystem(self.sim_world, self.learner, epsilon=self.train_epsilon, visualize=train_visualize, frame_delay=frame_delay)
+        self.rl_system = RLSystem(self.sim_world, self.learner, epsilon=self.train_epsilon, visualize=train_visualize, frame_delay=frame_delay, mcts_params=self.mcts_params, replay_params=replay_params, augment=augment, self_play_workers=self_play_workers, weight_refresh=weight_refresh, batch_games=batch_games, cache_size=cache_size)
         self.players = []
         self.train_time = 0
         self.visualizer = Visualizer(self.sim_world, frame_delay=frame_delay)
@@ -48,7 +91,8 @@ class TOPP:
     def restore_trained_players(self, train_time):
         path = os.walk(f"./topp/{train_time}")
         for root, dirs, files in path:
-            sorted_dirs = sorted(list(map(lambda d: int(d), dirs)))
+            # Checkpoints are the numbered directories, the replay buffer segments live next to them
+            sorted_dirs = sorted(list(map(lambda d: int(d), filter(str.isdigit, dirs))))
             inc = floor(len(sorted_dirs) // (self.player_count - 1))
             if inc == 0:
                 inc = 1
@@ -67,7 +111,7 @@ class TOPP:
 
     def restore_actor_from_dir(self, root, dir):
         new_learner = self.new_learner()
-        new_player = Actor(self.sim_world, new_learner, use_mcts=bool(self.topp_search_games) if int(dir) > 0 else False)
+        new_player = Actor(self.sim_world, new_learner, use_mcts=bool(self.topp_search_games or self.topp_time_limit) if int(dir) > 0 else False, mcts_params=self.mcts_params, cache_size=self.cache_size, tactical_cache=self.tactical_cache)
         print(root, dir)
         new_player.load_learner(f"{root}/{dir}")
         return new_player
@@ -77,7 +121,7 @@ class TOPP:
         for root, dirs, files in path:
             if train_opponent:
                 self.rl_system.set_opponent(self.restore_actor_from_dir(root, str(train_opponent)))
-            max_dir = str(max(map(lambda dir: int(dir), dirs)))
+            max_dir = str(max(map(lambda dir: int(dir), filter(str.isdigit, dirs))))
             self.rl_system.actor = self.restore_actor_from_dir(root, max_dir)
             self.init_episodes = int(max_dir)
             break
@@ -104,60 +148,92 @@ class TOPP:
         for p in self.players:
             scores[p[0]] = (0, 0)
 
-        reverse_players = sorted(self.players, reverse=True)
-        for game_number in range(self.games_count):
-            # Alternate between who is going to start the match
-            reverse_start = bool(game_number % 2)
-            
-            # Go through all player, and for each player go through all players who have not played
+        if self.topp_batch:
+            # All games of a pair are played at once with the learners' policies, without search
             for i in range(len(self.players)):
-                p1 = reverse_players[i] if reverse_start else self.players[i]
                 for j in range(i + 1, len(self.players)):
-                    p2 = reverse_players[j] if reverse_start else self.players[j]
-                    print(p1[0], p2[0])
-                    
-                    # Play match between p1 and p2 and add the result
-                    result = self.play_actor_match(p1[0], p1[1], p2[0], p2[1])
-                    p1_score = scores[p1[0]]
-                    p2_score = scores[p2[0]]
-                    if result == 1:
-                        scores[p1[0]] = (p1_score[0] + 1, p1_score[1])
-                        scores[p2[0]] = (p2_score[0], p2_score[1] + 1)
-                    elif result == -1:
-                        scores[p1[0]] = (p1_score[0], p1_score[1] + 1)
-                        scores[p2[0]] = (p2_score[0] + 1, p2_score[1])
-        
+                    p1, p2 = self.players[i], self.players[j]
+                    rewards = self.play_batch_match(p1[1], p2[1], self.games_count)
+                    p1_wins = int((rewards == 1).sum())
+                    p2_wins = int((rewards == -1).sum())
+                    print(p1[0], p2[0], "Result: ", p1_wins, p2_wins)
+                    scores[p1[0]] = (scores[p1[0]][0] + p1_wins, scores[p1[0]][1] + p2_wins)
+                    scores[p2[0]] = (scores[p2[0]][0] + p2_wins, scores[p2[0]][1] + p1_wins)
+        elif self.topp_workers > 1:
+            self.play_parallel_matches(scores)
+        else:
+            for p1, p2 in self.get_match_schedule():
+                print(p1[0], p2[0])
+
+                # Play match between p1 and p2 and add the result
+                result = self.play_actor_match(p1[0], p1[1], p2[0], p2[1])
+                self.add_result(scores, p1[0], p2[0], result)
+            for name, player in self.players:
+                if player.dist_cache is not None:
+                    print(f"{name} cached dists: {player.dist_cache.stats()}")
+            if self.tactical_cache is not None:
+                print(f"Cached tactics: {self.tactical_cache.stats()}")
+
+        for name, player in self.players:
+            player.close()
+
         # Print scores and save results based on arguments
         for player, s in scores.items():
             print(player, s)
         if save_results:
             self.save_scores(scores)
 
+    def get_match_schedule(self):
+        # Every pair of players meets once per game number, and every other game number the player order is reversed
+        # so the other player of the pair starts
+        schedule = []
+        reverse_players = sorted(self.players, reverse=True)
+        for game_number in range(self.games_count):
+            reverse_start = bool(game_number % 2)
+            for i in range(len(self.players)):
+                p1 = reverse_players[i] if reverse_start else self.players[i]
+                for j in range(i + 1, len(self.players)):
+                    p2 = reverse_players[j] if reverse_start else self.players[j]
+                    schedule.append((p1, p2))
+        return schedule
+
+    def add_result(self, scores, p1_name, p2_name, result):
+        p1_score = scores[p1_name]
+        p2_score = scores[p2_name]
+        if result == 1:
+            scores[p1_name] = (p1_score[0] + 1, p1_score[1])
+            scores[p2_name] = (p2_score[0], p2_score[1] + 1)
+        elif result == -1:
+            scores[p1_name] = (p1_score[0], p1_score[1] + 1)
+            scores[p2_name] = (p2_score[0] + 1, p2_score[1])
+
+    def play_parallel_matches(self, scores):
+        # The matches are independent, so a pool of worker processes plays them. Workers load a player from
+        # ./topp/<id>/<episodes> the first time they play it and keep it for their later matches
+        context = multiprocessing.get_context("spawn")
+        initargs = (f"./topp/{self.train_time}", self.sim_world, type(self.learner), self.learner.params, self.mcts_params, self.cache_size, self.topp_search_games, self.topp_search_game_delay, self.topp_time_limit, self.quad_forks)
+        matches = [(p1[0], p2[0]) for p1, p2 in self.get_match_schedule()]
+        with context.Pool(self.topp_workers, initializer=init_topp_worker, initargs=initargs) as pool:
+            for p1_name, p2_name, result in pool.imap_unordered(run_topp_match, matches):
+                print(p1_name, p2_name, "Result: ", result)
+                self.add_result(scores, p1_name, p2_name, result)
+
     def play_actor_match(self, p1_name, p1: Actor, p2_name, p2: Actor):
-        self.sim_world.produce_init_state()
-        self.visualizer.init_visualize_episode(title=f"{p1_name} (BLACK) vs {p2_name} (RED)")
-        move_count = 0
-        while not self.sim_world.is_final_state():
-            self.visualizer.visualize_state()
-            t = time.time()
-            action = self.sim_world.get_action_space()[0]
-            search_games = self.topp_search_games if move_count > self.topp_search_game_delay else 0
-            if self.sim_world.get_current_player():
-                action = p1.get_action(self.sim_world.get_current_encoded_state(), 0, mcts_episodes=search_games)
-            else:
-                action = p2.get_action(self.sim_world.get_current_encoded_state(), 0, mcts_episodes=search_games)
-            # print(self.sim_world.get_current_encoded_state(), action)
-            self.sim_world.perform_action(action)
-            # print(action, self.sim_world.get_current_encoded_state())
-            d = time.time() - t
-            if d > 1:
-                print("Time taken: ", d, d < 1)
-            move_count += 1
-        self.visualizer.visualize_final_state()
-        result = self.sim_world.get_reward()
-        print("Result: ", result)
-        print()
-        return result
+        return play_match(self.sim_world, self.visualizer, p1_name, p1, p2_name, p2, self.topp_search_games, self.topp_search_game_delay, self.topp_time_limit, self.quad_forks)
+
+    def play_batch_match(self, p1: Actor, p2: Actor, games, epsilon=0):
+        # p1 plays black and p2 red in every game, with the starting player alternating between games
+        batch = self.sim_world.get_batch(games)
+        batch.produce_init_state(np.arange(games) % 2 == 0)
+        while not batch.all_final():
+            running = np.flatnonzero(~batch.is_final_states())
+            states = batch.get_encoded_states()
+            masks = batch.get_legal_masks()
+            players = batch.get_current_players()
+            for actor, to_move in ((p1, running[players[running]]), (p2, running[~players[running]])):
+                if len(to_move):
+                    batch.perform_actions(actor.choose_batch_actions(states[to_move], masks[to_move], epsilon), to_move)
+        return batch.get_rewards()
 
     def save_scores(self, scores):
         # Create file if it doesn't exist
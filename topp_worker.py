@@ -0,0 +1,58 @@
+import copy
+import random
+import numpy as np
+
+from actor import Actor
+from mcts import MCTS_Parameters
+from simworlds.simworld import SimWorld
+from state_cache import StateCache
+from visualizer import Visualizer
+
+# State of a tournament worker process, set up once by init_topp_worker
+worker_run_dir = None
+worker_sim_world = None
+worker_visualizer = None
+worker_learner_class = None
+worker_learner_params = None
+worker_mcts_params = None
+worker_cache_size = 0
+worker_tactical_cache = None
+worker_match_params = None
+worker_actors = {}
+
+
+def init_topp_worker(run_dir, sim_world: SimWorld, learner_class, learner_params, mcts_params: MCTS_Parameters, cache_size, search_games, search_game_delay, time_limit, quad_forks):
+    global worker_run_dir, worker_sim_world, worker_visualizer, worker_learner_class, worker_learner_params, worker_mcts_params, worker_cache_size, worker_tactical_cache, worker_match_params
+    random.seed()
+    np.random.seed()
+    worker_run_dir = run_dir
+    worker_sim_world = sim_world
+    worker_visualizer = Visualizer(sim_world)
+    worker_visualizer.set_visualize(False)
+    worker_learner_class = learner_class
+    worker_learner_params = learner_params
+    # Pool workers are daemonic and can't start search pools of their own, the tournament is already spread over processes
+    worker_mcts_params = copy.copy(mcts_params) if mcts_params else MCTS_Parameters()
+    worker_mcts_params.workers = 1
+    worker_cache_size = cache_size
+    worker_tactical_cache = StateCache(cache_size) if cache_size else None
+    worker_match_params = (search_games, search_game_delay, time_limit, quad_forks)
+
+
+def load_topp_actor(name):
+    # Same as TOPP.restore_actor_from_dir, but every player is only loaded once per worker
+    actor = worker_actors.get(name)
+    if actor is None:
+        search_games, search_game_delay, time_limit, quad_forks = worker_match_params
+        actor = Actor(worker_sim_world, worker_learner_class(worker_learner_params), use_mcts=bool(search_games or time_limit) if int(name) > 0 else False, mcts_params=worker_mcts_params, cache_size=worker_cache_size, tactical_cache=worker_tactical_cache)
+        actor.load_learner(f"{worker_run_dir}/{name}")
+        worker_actors[name] = actor
+    return actor
+
+
+def run_topp_match(match):
+    # Imported here since topp imports this module
+    from topp import play_match
+    p1_name, p2_name = match
+    result = play_match(worker_sim_world, worker_visualizer, p1_name, load_topp_actor(p1_name), p2_name, load_topp_actor(p2_name), *worker_match_params)
+    return p1_name, p2_name, result
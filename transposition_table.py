@@ -0,0 +1,91 @@
+from collections import OrderedDict
+
+from tree_node import TreeNode
+
+
+class TranspositionTable:
+    """
+    Maps state keys to the shared TreeNode for that state, with an optional capacity.
+
+    When the table holds more than capacity nodes at the end of a search game, nodes that
+    were not touched during that game are evicted, either the least recently used ("lru")
+    or the least visited ("visits") first. Evicted nodes drop their children and edge
+    statistics, and are put back in the table if the search reaches them again.
+    """
+
+    def __init__(self, capacity=0, eviction="lru"):
+        self.capacity = capacity
+        self.eviction = eviction
+        self.entries = OrderedDict()
+        self.tick = 1
+        self.evicted_count = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        node = self.entries.get(key)
+        if node is not None:
+            self.touch(node)
+        return node
+
+    def put(self, node: TreeNode):
+        node.evicted = False
+        self.entries[node.key] = node
+        self.touch(node)
+
+    def touch(self, node: TreeNode):
+        node.touched = self.tick
+        if self.capacity and self.eviction == "lru":
+            self.entries.move_to_end(node.key)
+
+    def prune(self, root: TreeNode):
+        # Drop every node that can no longer be reached from the root, returning how many nodes and edges were freed
+        reachable = set()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if id(node) not in reachable:
+                reachable.add(id(node))
+                stack.extend(node.children)
+        freed_nodes = 0
+        freed_edges = 0
+        for key, node in list(self.entries.items()):
+            if id(node) not in reachable:
+                freed_nodes += 1
+                freed_edges += len(node.children)
+                del self.entries[key]
+                node.clear_children()
+        return freed_nodes, freed_edges
+
+    def end_search_game(self):
+        if self.capacity and len(self.entries) > self.capacity:
+            if self.eviction == "visits":
+                self.evict_least_visited()
+            else:
+                self.evict_least_recent()
+        self.tick += 1
+
+    def evict_least_recent(self):
+        skipped = []
+        while len(self.entries) + len(skipped) > self.capacity and self.entries:
+            key, node = self.entries.popitem(last=False)
+            if node.touched == self.tick:
+                skipped.append(node)
+            else:
+                self.evict(node)
+        for node in skipped:
+            self.entries[node.key] = node
+
+    def evict_least_visited(self):
+        # Evict a tenth of the capacity below the limit at once, so the sort is amortized over many games
+        target = self.capacity - self.capacity // 10
+        candidates = sorted((node for node in self.entries.values() if node.touched != self.tick), key=lambda node: node.visits)
+        for node in candidates[:max(0, len(self.entries) - target)]:
+            del self.entries[node.key]
+            self.evict(node)
+
+    def evict(self, node: TreeNode):
+        node.clear_children()
+        node.evicted = True
+        self.evicted_count += 1
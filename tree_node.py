@@ -1,4 +1,3 @@
-
 class TreeNode:
 
     state = None
@@ -8,16 +7,30 @@ class TreeNode:
     prev_action = None
     children = []
 
-    def __init__(self, state, player, parent, prev_action, rollout = False):
+    def __init__(self, state, player, parent, prev_action, rollout = False, key = None):
         self.state = state
         self.player = player
         self.parent = parent
         self.rollout = rollout
         self.prev_action = prev_action
-        self.children = []
+        self.key = key if key is not None else state
+        self.visits = 0
+        self.touched = 0
+        self.evicted = False
+        self.clear_children()
 
-    def add_child(self, tree_node):
+    def add_child(self, tree_node, action=None):
         self.children.append(tree_node)
+        self.actions.append(action if action is not None else tree_node.prev_action)
+        self.edge_visits.append(0)
+        self.edge_values.append(0)
+
+    def clear_children(self):
+        # Edge statistics are stored on the parent, aligned with the children list
+        self.children = []
+        self.actions = []
+        self.edge_visits = []
+        self.edge_values = []
 
     def set_parent(self, parent_node):
         self.parent = parent_node